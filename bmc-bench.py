@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse, hashlib, importlib.util, os, os.path, random, shutil, sys, tempfile, time
+from struct import pack
+
+spec = importlib.util.spec_from_file_location("bmc_tools", os.path.join(os.path.dirname(os.path.abspath(__file__)), "bmc-tools.py"))
+bmc_tools = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(bmc_tools)
+BMCContainer = bmc_tools.BMCContainer
+BMCCollage = bmc_tools.BMCCollage
+
+GOLDEN = {"Cache0000.bin": "62a37d32b73fb4e361f16aa7ddc2d86f", "bcache11.bmc": "1c523e4992e1d73288c03c224fe6f831", "bcache12.bmc": "0f432c3f39bd0fbc0e9b281149bb9dae", "bcache13.bmc": "dec16df2860da48f912100383521343c", "bcache14.bmc": "c15df65c44ed61453ec59dca781782ec", "bcache2.bmc": "8d8b028a5e7fa095be8567a877f8a149", "bcache22.bmc": "3ac554e91b0924770b14406c12fd084e", "bcache24.bmc": "2e7fe673edaafcafd9aa0030fa533f2c"}
+
+class BMCSynth():
+	COLORS = [(0xFF, 0xFF, 0xFF, 0xFF), (0x00, 0x00, 0x00, 0x00), (0xF0, 0xF0, 0xF0, 0x00), (0x99, 0x33, 0x00, 0x00), (0xD4, 0xD0, 0xC8, 0x00), (0x0A, 0x24, 0x6A, 0x00), (0x80, 0x80, 0x80, 0x00)]
+	FAMILIES = ["bg", "bg", "fg", "fgset", "color", "color", "color", "dither", "mask", "fgmask", "fixmask", "raw", "raw", "white", "black"]
+	def __init__(self, seed):
+		self.rnd = random.Random(seed)
+	def s_bytes(self, n):
+		return bytes(bytearray([self.rnd.getrandbits(8) for i in range(n)]))
+	def s_color(self, bbp):
+		return bytes(bytearray(self.rnd.choice(self.COLORS)[:bbp]))
+	def s_count(self, rem, hi):
+		return min(rem, self.rnd.choice([1, 2, 3, 5, 8, 13, 24, 40, 64, 100, 180, 300, hi]))
+	def s_order(self, op, bits, mega, n):
+		base = 1<<bits
+		if 0 < n < base and self.rnd.random() < 0.7:
+			return bytearray((op|n, ))
+		elif base <= n < base+256 and self.rnd.random() < 0.7:
+			return bytearray((op, n-base))
+		return bytearray((mega, ))+pack("<H", n)
+	def s_mask_order(self, op, bits, mega, n):
+		if n%8 == 0 and 0 < n//8 < (1<<bits) and self.rnd.random() < 0.7:
+			return bytearray((op|(n//8), ))
+		elif 0 < n <= 256 and self.rnd.random() < 0.7:
+			return bytearray((op, n-1))
+		return bytearray((mega, ))+pack("<H", n)
+	def s_rle(self, bbp, npx):
+		out = bytearray()
+		px = 0
+		while px < npx:
+			rem = npx-px
+			fam = self.rnd.choice(self.FAMILIES)
+			if fam == "bg":
+				n = self.s_count(rem, 1000)
+				out+=self.s_order(0x00, 5, 0xF0, n)
+			elif fam == "fg":
+				n = self.s_count(rem, 1000)
+				out+=self.s_order(0x20, 5, 0xF1, n)
+			elif fam == "fgset":
+				n = self.s_count(rem, 1000)
+				if self.rnd.random() < 0.5:
+					out+=self.s_order(0xC0, 4, 0xF6, n)
+				else:
+					out+=bytearray((0xF6, ))+pack("<H", n)
+				out+=self.s_color(bbp)
+			elif fam == "color":
+				n = self.s_count(rem, 2000)
+				out+=self.s_order(0x60, 5, 0xF3, n)+self.s_color(bbp)
+			elif fam == "dither" and rem >= 2:
+				n = self.s_count(rem//2, 500)
+				out+=self.s_order(0xE0, 4, 0xF8, n)+self.s_color(bbp)+self.s_color(bbp)
+				n*=2
+			elif fam == "mask" and rem >= 8:
+				n = self.s_count(rem, 240)
+				out+=self.s_mask_order(0x40, 5, 0xF2, n)+self.s_bytes((n+7)//8)
+			elif fam == "fgmask" and rem >= 8:
+				n = self.s_count(rem, 120)
+				out+=self.s_mask_order(0xD0, 4, 0xF7, n)+self.s_color(bbp)+self.s_bytes((n+7)//8)
+			elif fam == "fixmask" and rem >= 8:
+				n = 8
+				out+=bytearray((self.rnd.choice([0xF9, 0xFA]), ))
+			elif fam == "raw":
+				n = self.s_count(rem, 64)
+				out+=self.s_order(0x80, 5, 0xF4, n)+self.s_bytes(n*bbp)
+			elif fam == "black":
+				n = 1
+				out+=bytearray((0xFE, ))
+			else:
+				n = 1
+				out+=bytearray((0xFD, ))
+			px+=n
+		return bytes(out)
+	def s_height(self):
+		return self.rnd.choice([64, 64, 64, self.rnd.randint(1, 63)])
+	def s_bin(self, fname, tiles):
+		with open(fname, "wb") as f:
+			f.write(BMCContainer.BIN_FILE_HEADER+pack("<L", 6))
+			for i in range(tiles):
+				h = self.s_height()
+				f.write(pack("<LLHH", self.rnd.getrandbits(32), self.rnd.getrandbits(32), 64, h)+self.s_bytes(4*64*h))
+	def s_bmc(self, fname, tiles, cf):
+		with open(fname, "wb") as f:
+			for i in range(tiles):
+				h = self.s_height()
+				f.write(pack("<LLHHLL", self.rnd.getrandbits(32), self.rnd.getrandbits(32), 64, h, cf*64*h, 0)+self.s_bytes(cf*64*64))
+	def s_bmc_rle(self, fname, tiles, bbp):
+		with open(fname, "wb") as f:
+			for i in range(tiles):
+				h = self.s_height()
+				data = self.s_rle(bbp, 64*h)
+				while len(data) > 64*64*bbp:
+					data = self.s_rle(bbp, 64*h)
+				f.write(pack("<LLHHLL", self.rnd.getrandbits(32), self.rnd.getrandbits(32), 64, h, len(data), 0x08)+data+bytes(bytearray(64*64*bbp-len(data))))
+
+CACHES = [("Cache0000.bin", lambda s, f, n: s.s_bin(f, n)), ("bcache11.bmc", lambda s, f, n: s.s_bmc(f, n, 1)), ("bcache12.bmc", lambda s, f, n: s.s_bmc(f, n, 2)), ("bcache13.bmc", lambda s, f, n: s.s_bmc(f, n, 3)), ("bcache14.bmc", lambda s, f, n: s.s_bmc(f, n, 4)), ("bcache2.bmc", lambda s, f, n: s.s_bmc_rle(f, n, 1)), ("bcache22.bmc", lambda s, f, n: s.s_bmc_rle(f, n, 2)), ("bcache24.bmc", lambda s, f, n: s.s_bmc_rle(f, n, 4))]
+
+def bench_cache(fname, dname, width):
+	res = []
+	bmcc = BMCContainer(old=True, width=width, logs=[])
+	t = time.perf_counter()
+	bmcc.b_import(fname)
+	res.append(("import", 0, len(bmcc.bdat), time.perf_counter()-t))
+	t = time.perf_counter()
+	recs = list(bmcc.b_scan())
+	res.append(("scan", len(recs), len(bmcc.bdat), time.perf_counter()-t))
+	raw = []
+	hs = bmcc.TILE_HEADER_SIZE[bmcc.btype]
+	t = time.perf_counter()
+	for rec in recs:
+		d = rec.offset+hs
+		if rec.compressed:
+			raw.append(bmcc.b_uncompress(bmcc.bdat[d:d+rec.length], rec.bpp//8))
+		else:
+			raw.append(bmcc.bdat[d:d+rec.length].tobytes())
+	res.append(("decode", len(recs), sum([rec.length for rec in recs]), time.perf_counter()-t))
+	t = time.perf_counter()
+	size = 0
+	b_parse = {32: bmcc.b_parse_rgb32b, 24: bmcc.b_parse_rgb24b, 16: bmcc.b_parse_rgb565, 8: lambda data: bmcc.PALETTE+data}
+	for rec, data in zip(recs, raw):
+		size+=len(bmcc.b_parse_rgb565(data) if rec.compressed else b_parse[rec.bpp](data))
+	res.append(("convert", len(recs), size, time.perf_counter()-t))
+	t = time.perf_counter()
+	tiles = list(bmcc.b_tiles())
+	h = hashlib.sha256()
+	for tile in tiles:
+		h.update(pack("<LLL", tile.index, len(tile.data), len(tile.old))+tile.data+tile.old)
+	res.append(("tiles", len(tiles), sum([len(tile.data)+len(tile.old) for tile in tiles]), time.perf_counter()-t))
+	t = time.perf_counter()
+	for tile in tiles:
+		bmcc.b_export_tile(dname, tile.index, tile.data, tile.old)
+	res.append(("export", len(tiles), sum([os.path.getsize(os.path.join(dname, f)) for f in os.listdir(dname)]), time.perf_counter()-t))
+	t = time.perf_counter()
+	c_name = os.path.join(dname, "collage.bmp")
+	collage = BMCCollage(bmcc, c_name)
+	for tile in tiles:
+		collage.b_add(tile.data)
+	collage.b_close()
+	res.append(("collage", len(tiles), os.path.getsize(c_name), time.perf_counter()-t))
+	for f in sorted(os.listdir(dname)):
+		with open(os.path.join(dname, f), "rb") as fd:
+			h.update(f.encode()+fd.read())
+	bmcc.b_flush()
+	return (res, h.hexdigest()[:32])
+
+def check_dedup(tmp, synth):
+	tiles = [synth.s_bytes(4*64*64) for i in range(3)]
+	dest = os.path.join(tmp, "dedup")
+	os.makedirs(dest)
+	srcs = []
+	for prof, order in [("p1", [0, 2]), ("p2", [1, 0])]:
+		os.makedirs(os.path.join(tmp, prof))
+		srcs.append(os.path.join(tmp, prof, "bcache24.bmc"))
+		with open(srcs[-1], "wb") as f:
+			for i in order:
+				f.write(pack("<LLHHLL", i, i, 64, 64, 4*64*64, 0)+tiles[i])
+	bmcc = BMCContainer(logs=[], dedup={})
+	for src in srcs:
+		bmc_tools.process_file(bmcc, src, dest, False)
+	ok = True
+	for (src, fname, stored), tile in zip(bmcc.dmap, bmc_tools.iter_tiles(srcs[-1], logs=[])):
+		with open(stored, "rb") as f:
+			ok = ok and f.read() == bmcc.b_encode(tile.data)
+	return ok
+
+if __name__ == "__main__":
+	prs = argparse.ArgumentParser(description="RDP Bitmap Cache parser benchmark")
+	prs.add_argument("-n", "--tiles", help="Specify the number of tiles of each synthetic cache (default=500).", type=int, default=500)
+	prs.add_argument("-w", "--width", help="Specify the number of tiles per line of the aggregated bitmap (default=64).", type=int, default=64)
+	prs.add_argument("-s", "--seed", help="Specify the seed of the synthetic caches (default=1).", type=int, default=1)
+	prs.add_argument("-k", "--keep", help="Specify a directory where to keep the synthetic caches.", default=None)
+	prs.add_argument("-u", "--update", help="Print the golden hashes of this run instead of checking them.", action="store_true", default=False)
+	args = prs.parse_args(sys.argv[1:])
+
+	tmp = tempfile.mkdtemp(prefix="bmc-bench-")
+	src = args.keep if args.keep is not None else os.path.join(tmp, "src")
+	if not os.path.isdir(src):
+		os.makedirs(src)
+	checked = (args.tiles, args.width, args.seed) == (500, 64, 1)
+	failed = 0
+	golden = {}
+	sys.stdout.write("%-14s %-8s %8s %10s %12s %10s%s" % ("cache", "stage", "tiles", "seconds", "tiles/s", "MB/s", os.linesep))
+	try:
+		for i, (name, synth) in enumerate(CACHES):
+			fname = os.path.join(src, name)
+			synth(BMCSynth(args.seed*len(CACHES)+i), fname, args.tiles)
+			dname = os.path.join(tmp, name)
+			os.makedirs(dname)
+			res, golden[name] = bench_cache(fname, dname, args.width)
+			shutil.rmtree(dname)
+			for stage, cnt, size, sec in res:
+				sec = max(sec, 1e-9)
+				sys.stdout.write("%-14s %-8s %8d %10.4f %12.1f %10.2f%s" % (name, stage, cnt, sec, cnt/sec, size/sec/(1<<20), os.linesep))
+			if not args.update and checked and name in GOLDEN and GOLDEN[name] != golden[name]:
+				sys.stderr.write("[!!!] Output of '%s' does not match its golden hash (%s instead of %s).%s" % (name, golden[name], GOLDEN[name], os.linesep))
+				failed+=1
+		if not check_dedup(tmp, BMCSynth(args.seed)):
+			sys.stderr.write("[!!!] Deduplicated bitmaps of same-named caches do not match their tiles.%s" % (os.linesep))
+			failed+=1
+	finally:
+		shutil.rmtree(tmp)
+	if args.update:
+		sys.stdout.write("GOLDEN = {%s}%s" % (", ".join(["\"%s\": \"%s\"" % (name, golden[name]) for name, synth in CACHES]), os.linesep))
+	elif not checked:
+		sys.stdout.write("[---] Golden hashes are only checked with the default tile count, width and seed.%s" % (os.linesep))
+	elif failed == 0:
+		sys.stdout.write("[===] All outputs match their golden hashes.%s" % (os.linesep))
+	exit(-1 if failed > 0 else 0)
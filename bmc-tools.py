@@ -1,8 +1,25 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import argparse, os, os.path, sys
-from struct import pack, unpack
+import argparse, csv, hashlib, heapq, io, json, mmap, multiprocessing, os, os.path, queue, re, signal, socketserver, sqlite3, stat, sys, tarfile, threading, time, zipfile, zlib
+from array import array
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.managers import SyncManager
+from struct import pack, unpack_from
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+BMCRecord = namedtuple("BMCRecord", ["index", "offset", "key1", "key2", "width", "height", "bpp", "length", "compressed", "stride"])
+BMCTile = namedtuple("BMCTile", ["index", "offset", "key1", "key2", "width", "height", "bpp", "data", "old"])
+
+class BMCImage(namedtuple("BMCImage", ["index", "offset", "key1", "key2", "width", "height", "bpp", "compressed", "rgba", "old"])):
+	__slots__ = ()
+	def b_array(self, old=False):
+		return np.asarray(self.old if old else self.rgba)
 
 class BMCContainer():
 	BIN_FILE_HEADER = b"RDP8bmp\x00"
@@ -10,12 +27,27 @@ class BMCContainer():
 	BMC_CONTAINER = b".BMC"
 	TILE_HEADER_SIZE = {BMC_CONTAINER: 0x14, BIN_CONTAINER: 0xC}
 	STRIPE_WIDTH = 64
+	TILE_BATCH = 256
+	CARVE_CHUNK = 1<<24
+	CARVE_RUN = {BMC_CONTAINER: 2, BIN_CONTAINER: 4}
+	CARVE_RE = re.compile(b"(?=[\x01-\x40]\x00[\x01-\x40]\x00)", re.S)
 	LOG_TYPES = ["[===]", "[+++]", "[---]", "[!!!]"]
+	VERSION = "4.00"
 	PALETTE = bytes(bytearray((0, 0, 0, 0, 0, 0, 128, 0, 0, 128, 0, 0, 0, 128, 128, 0, 128, 0, 0, 0, 128, 0, 128, 0, 128, 128, 0, 0, 192, 192, 192, 0, 192, 220, 192, 0, 240, 202, 166, 0, 0, 32, 64, 0, 0, 32, 96, 0, 0, 32, 128, 0, 0, 32, 160, 0, 0, 32, 192, 0, 0, 32, 224, 0, 0, 64, 0, 0, 0, 64, 32, 0, 0, 64, 64, 0, 0, 64, 96, 0, 0, 64, 128, 0, 0, 64, 160, 0, 0, 64, 192, 0, 0, 64, 224, 0, 0, 96, 0, 0, 0, 96, 32, 0, 0, 96, 64, 0, 0, 96, 96, 0, 0, 96, 128, 0, 0, 96, 160, 0, 0, 96, 192, 0, 0, 96, 224, 0, 0, 128, 0, 0, 0, 128, 32, 0, 0, 128, 64, 0, 0, 128, 96, 0, 0, 128, 128, 0, 0, 128, 160, 0, 0, 128, 192, 0, 0, 128, 224, 0, 0, 160, 0, 0, 0, 160, 32, 0, 0, 160, 64, 0, 0, 160, 96, 0, 0, 160, 128, 0, 0, 160, 160, 0, 0, 160, 192, 0, 0, 160, 224, 0, 0, 192, 0, 0, 0, 192, 32, 0, 0, 192, 64, 0, 0, 192, 96, 0, 0, 192, 128, 0, 0, 192, 160, 0, 0, 192, 192, 0, 0, 192, 224, 0, 0, 224, 0, 0, 0, 224, 32, 0, 0, 224, 64, 0, 0, 224, 96, 0, 0, 224, 128, 0, 0, 224, 160, 0, 0, 224, 192, 0, 0, 224, 224, 0, 64, 0, 0, 0, 64, 0, 32, 0, 64, 0, 64, 0, 64, 0, 96, 0, 64, 0, 128, 0, 64, 0, 160, 0, 64, 0, 192, 0, 64, 0, 224, 0, 64, 32, 0, 0, 64, 32, 32, 0, 64, 32, 64, 0, 64, 32, 96, 0, 64, 32, 128, 0, 64, 32, 160, 0, 64, 32, 192, 0, 64, 32, 224, 0, 64, 64, 0, 0, 64, 64, 32, 0, 64, 64, 64, 0, 64, 64, 96, 0, 64, 64, 128, 0, 64, 64, 160, 0, 64, 64, 192, 0, 64, 64, 224, 0, 64, 96, 0, 0, 64, 96, 32, 0, 64, 96, 64, 0, 64, 96, 96, 0, 64, 96, 128, 0, 64, 96, 160, 0, 64, 96, 192, 0, 64, 96, 224, 0, 64, 128, 0, 0, 64, 128, 32, 0, 64, 128, 64, 0, 64, 128, 96, 0, 64, 128, 128, 0, 64, 128, 160, 0, 64, 128, 192, 0, 64, 128, 224, 0, 64, 160, 0, 0, 64, 160, 32, 0, 64, 160, 64, 0, 64, 160, 96, 0, 64, 160, 128, 0, 64, 160, 160, 0, 64, 160, 192, 0, 64, 160, 224, 0, 64, 192, 0, 0, 64, 192, 32, 0, 64, 192, 64, 0, 64, 192, 96, 0, 64, 192, 128, 0, 64, 192, 160, 0, 64, 192, 192, 0, 64, 192, 224, 0, 64, 224, 0, 0, 64, 224, 32, 0, 64, 224, 64, 0, 64, 224, 96, 0, 64, 224, 128, 0, 64, 224, 160, 0, 64, 224, 192, 0, 64, 224, 224, 0, 128, 0, 0, 0, 128, 0, 32, 0, 128, 0, 64, 0, 128, 0, 96, 0, 128, 0, 128, 0, 128, 0, 160, 0, 128, 0, 192, 0, 128, 0, 224, 0, 128, 32, 0, 0, 128, 32, 32, 0, 128, 32, 64, 0, 128, 32, 96, 0, 128, 32, 128, 0, 128, 32, 160, 0, 128, 32, 192, 0, 128, 32, 224, 0, 128, 64, 0, 0, 128, 64, 32, 0, 128, 64, 64, 0, 128, 64, 96, 0, 128, 64, 128, 0, 128, 64, 160, 0, 128, 64, 192, 0, 128, 64, 224, 0, 128, 96, 0, 0, 128, 96, 32, 0, 128, 96, 64, 0, 128, 96, 96, 0, 128, 96, 128, 0, 128, 96, 160, 0, 128, 96, 192, 0, 128, 96, 224, 0, 128, 128, 0, 0, 128, 128, 32, 0, 128, 128, 64, 0, 128, 128, 96, 0, 128, 128, 128, 0, 128, 128, 160, 0, 128, 128, 192, 0, 128, 128, 224, 0, 128, 160, 0, 0, 128, 160, 32, 0, 128, 160, 64, 0, 128, 160, 96, 0, 128, 160, 128, 0, 128, 160, 160, 0, 128, 160, 192, 0, 128, 160, 224, 0, 128, 192, 0, 0, 128, 192, 32, 0, 128, 192, 64, 0, 128, 192, 96, 0, 128, 192, 128, 0, 128, 192, 160, 0, 128, 192, 192, 0, 128, 192, 224, 0, 128, 224, 0, 0, 128, 224, 32, 0, 128, 224, 64, 0, 128, 224, 96, 0, 128, 224, 128, 0, 128, 224, 160, 0, 128, 224, 192, 0, 128, 224, 224, 0, 192, 0, 0, 0, 192, 0, 32, 0, 192, 0, 64, 0, 192, 0, 96, 0, 192, 0, 128, 0, 192, 0, 160, 0, 192, 0, 192, 0, 192, 0, 224, 0, 192, 32, 0, 0, 192, 32, 32, 0, 192, 32, 64, 0, 192, 32, 96, 0, 192, 32, 128, 0, 192, 32, 160, 0, 192, 32, 192, 0, 192, 32, 224, 0, 192, 64, 0, 0, 192, 64, 32, 0, 192, 64, 64, 0, 192, 64, 96, 0, 192, 64, 128, 0, 192, 64, 160, 0, 192, 64, 192, 0, 192, 64, 224, 0, 192, 96, 0, 0, 192, 96, 32, 0, 192, 96, 64, 0, 192, 96, 96, 0, 192, 96, 128, 0, 192, 96, 160, 0, 192, 96, 192, 0, 192, 96, 224, 0, 192, 128, 0, 0, 192, 128, 32, 0, 192, 128, 64, 0, 192, 128, 96, 0, 192, 128, 128, 0, 192, 128, 160, 0, 192, 128, 192, 0, 192, 128, 224, 0, 192, 160, 0, 0, 192, 160, 32, 0, 192, 160, 64, 0, 192, 160, 96, 0, 192, 160, 128, 0, 192, 160, 160, 0, 192, 160, 192, 0, 192, 160, 224, 0, 192, 192, 0, 0, 192, 192, 32, 0, 192, 192, 64, 0, 192, 192, 96, 0, 192, 192, 128, 0, 192, 192, 160, 0, 240, 251, 255, 0, 164, 160, 160, 0, 128, 128, 128, 0, 0, 0, 255, 0, 0, 255, 0, 0, 0, 255, 255, 0, 255, 0, 0, 0, 255, 0, 255, 0, 255, 255, 0, 0, 255, 255, 255, 0)))
 	COLOR_BLACK = b"\x00"
 	COLOR_WHITE = b"\xFF"
-	def __init__(self, verbose=False, count=0, old=False, big=False, width=64):
+	RGB565_LUT = None
+	RGB565_NP = None
+	RLE_BG, RLE_FG, RLE_DITHER, RLE_COLOR, RLE_MASK, RLE_RAW, RLE_WHITE, RLE_BLACK = range(8)
+	RLE_TABLE = None
+	RLE_BITS = None
+	def __init__(self, verbose=False, count=0, old=False, big=False, width=64, logs=None, tjobs=1, dedup=None, index=None, select=None, stats=False, fmt="bmp", bundle=None, writers=0, carve=False, stitch=False):
+		self.logs = logs
 		self.bdat = ""
+		self.bmap = None
+		self.boff = 0
+		self.bres = False
+		self.ecnt = 0
 		self.o_bmps = []
 		self.bmps = []
 		self.btype = None
@@ -26,47 +58,107 @@ class BMCContainer():
 		self.verb = verbose
 		self.big = big
 		self.STRIPE_WIDTH = width
+		self.tjobs = tjobs
+		self.dedup = dedup
+		self.dmap = []
+		self.dcnt = 0
+		self.index = index
+		self.idb = None
+		self.select = select
+		self.last = ""
+		self.fhash = None
+		self.hashing = False
+		self.stats = BMCStats() if stats else None
+		self.fmt = fmt
+		self.bundle = bundle
+		self.out = None
+		self.writers = writers
+		self.wq = None
+		self.wlock = threading.Lock()
+		self.werr = None
+		self.carve = carve
+		self.craw = {}
+		self.stitch = stitch
+		self.rec = None
 		if count > 0:
 			self.b_log(sys.stdout, True, 2, "At most %d tiles will be processed." % (count))
 		if old:
 			self.b_log(sys.stdout, True, 2, "Old data will also be saved in separate files.")
 	def b_log(self, stream, verbose, ltype, lmsg):
 		if not verbose or self.verb:
-			stream.write("%s %s%s" % (self.LOG_TYPES[ltype], lmsg, os.linesep))
+			if self.logs is not None:
+				self.logs.append((stream is sys.stderr, "%s %s%s" % (self.LOG_TYPES[ltype], lmsg, os.linesep)))
+			else:
+				stream.write("%s %s%s" % (self.LOG_TYPES[ltype], lmsg, os.linesep))
+		return True
+	def b_replay(self, logs):
+		for err, l in logs:
+			if self.logs is not None:
+				self.logs.append((err, l))
+			else:
+				(sys.stderr if err else sys.stdout).write(l)
 		return True
+	def b_timed(self, stage, func, data, *args):
+		if self.stats is None:
+			return func(data, *args)
+		clk = self.stats.b_clock()
+		res = func(data, *args)
+		self.stats.b_stage(stage, clk, len(data), len(res))
+		return res
 	def b_import(self, fname):
+		with open(fname, "rb") as f:
+			return self.b_load(f, fname)
+	def b_load(self, src, name=None):
 		if len(self.bdat) > 0:
 			self.b_log(sys.stderr, False, 3, "Data is already waiting to be processed; aborting.")
 			return False
-		with open(fname, "rb") as f:
-			self.bdat = memoryview(f.read())
+		clk = self.stats.b_clock() if self.stats is not None else None
+		if isinstance(src, (bytes, bytearray, memoryview, mmap.mmap)):
+			self.bdat = memoryview(src).cast("B")
+		else:
+			try:
+				self.bmap = mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ)
+				self.bdat = memoryview(self.bmap)
+			except (AttributeError, io.UnsupportedOperation):
+				self.bdat = memoryview(src.read())
+			except ValueError:
+				self.bdat = ""
+			except (OSError, mmap.error):
+				self.bdat = memoryview(src.read())
 		if len(self.bdat) == 0:
 			self.b_log(sys.stderr, False, 3, "Unable to retrieve file contents; aborting.")
 			return False
-		self.fname = fname
+		self.fname = name if name is not None else getattr(src, "name", "")
 		self.btype = self.BMC_CONTAINER
+		self.boff = 0
 		if self.bdat[:len(self.BIN_FILE_HEADER)] == self.BIN_FILE_HEADER:
-			self.b_log(sys.stdout, True, 2, "Subsequent header version: %d." % (unpack("<L", self.bdat[len(self.BIN_FILE_HEADER):len(self.BIN_FILE_HEADER)+4])[0]))
-			self.bdat = self.bdat[len(self.BIN_FILE_HEADER)+4:]
+			self.b_log(sys.stdout, True, 2, "Subsequent header version: %d." % (unpack_from("<L", self.bdat, len(self.BIN_FILE_HEADER))[0]))
+			self.boff = len(self.BIN_FILE_HEADER)+4
 			self.btype = self.BIN_CONTAINER
+		if clk is not None:
+			self.stats.b_stage("import", clk, len(self.bdat), 0)
 		self.b_log(sys.stdout, True, 0, "Successfully loaded '%s' as a %s container." % (self.fname, self.btype.decode()))
 		return True
-	def b_process(self):
+	def b_scan(self):
+		self.bres = False
 		if len(self.bdat) == 0:
 			self.b_log(sys.stderr, False, 3, "Nothing to process.")
-			return False
+			return
+		hs = self.TILE_HEADER_SIZE[self.btype]
+		off = self.boff
 		bl = 0
-		while len(self.bdat) > 0:
-			old = False
-			o_bmp = ""
-			t_hdr = self.bdat[:self.TILE_HEADER_SIZE[self.btype]]
-			key1, key2, t_width, t_height = unpack("<LLHH", t_hdr[:0xC])
+		idx = 0
+		while off < len(self.bdat):
+			if off+hs > len(self.bdat):
+				self.b_log(sys.stderr, False, 3, "Truncated tile header found at offset 0x%X; stopping." % (off))
+				break
+			d = off+hs
+			key1, key2, t_width, t_height = unpack_from("<LLHH", self.bdat, off)
 			if self.btype == self.BIN_CONTAINER:
 				bl = 4*t_width*t_height
-				t_bmp = self.b_parse_rgb32b(self.bdat[len(t_hdr):len(t_hdr)+bl].tobytes())
-			elif self.btype == self.BMC_CONTAINER:
-				t_bmp = ""
-				t_len, t_params = unpack("<LL", t_hdr[-0x8:])
+				rec = BMCRecord(idx, off, key1, key2, t_width, t_height, 32, bl, False, hs+bl)
+			else:
+				t_len, t_params = unpack_from("<LL", self.bdat, off+0xC)
 				if t_params & 0x08: #This bit is always ONE when relevant data is smaller than expected data, thus it is most likely the "compression" bit flag.
 					if bl == 0:
 						if "22.bmc" in self.fname:
@@ -77,306 +169,1343 @@ class BMCContainer():
 							bl = 64*64
 						else:
 							for b in [1, 2, 4]:
-								if len(self.bdat) < len(t_hdr)+64*64*b+8:
+								if len(self.bdat) < d+64*64*b+10:
 									break
-								elif unpack("<H", self.bdat[len(t_hdr)+64*64*b+8:][:2])[0] == 64:
+								elif unpack_from("<H", self.bdat, d+64*64*b+8)[0] == 64:
 									bl = 64*64*b
 									break
 							if bl == 0:
 								self.b_log(sys.stderr, False, 3, "Unable to determine data pattern size; exiting before throwing any error!")
-								return False
-					o_bmp = b""
-					t_bmp = self.b_uncompress(self.bdat[len(t_hdr):len(t_hdr)+t_len].tobytes(), bl//(64*64))
-					if len(t_bmp) > 0:
-						if len(t_bmp) != t_width*t_height*bl//(64*64):
-							self.b_log(sys.stderr, False, 3, "Uncompressed tile data seems bogus (uncompressed %d bytes while expecting %d). Discarding tile." % (len(t_bmp), t_width*t_height*bl//(64*64)))
-							t_bmp = b""
-						else:
-							t_bmp = self.b_parse_rgb565(t_bmp)
+								return
+					rec = BMCRecord(idx, off, key1, key2, t_width, t_height, 8*bl//(64*64), t_len, True, hs+bl)
 				else:
-					cf = t_len//(t_width*t_height)
-					if cf == 4:
-						t_bmp = self.b_parse_rgb32b(self.bdat[len(t_hdr):len(t_hdr)+cf*t_width*t_height].tobytes())
-						if t_height != 64:
-							old = True
-							o_bmp = self.b_parse_rgb32b(self.bdat[len(t_hdr)+cf*t_width*t_height:len(t_hdr)+cf*64*64].tobytes())
-					elif cf == 3:
-						t_bmp = self.b_parse_rgb24b(self.bdat[len(t_hdr):len(t_hdr)+cf*t_width*t_height].tobytes())
-						if t_height != 64:
-							old = True
-							o_bmp = self.b_parse_rgb24b(self.bdat[len(t_hdr)+cf*t_width*t_height:len(t_hdr)+cf*64*64].tobytes())
-					elif cf == 2:
-						t_bmp = self.b_parse_rgb565(self.bdat[len(t_hdr):len(t_hdr)+cf*t_width*t_height].tobytes())
-						if t_height != 64:
-							old = True
-							o_bmp = self.b_parse_rgb565(self.bdat[len(t_hdr)+cf*t_width*t_height:len(t_hdr)+cf*64*64].tobytes())
-					elif cf == 1:
-						self.pal = True
-						t_bmp = self.PALETTE+self.bdat[len(t_hdr):len(t_hdr)+cf*t_width*t_height].tobytes()
-						if t_height != 64:
-							old = True
-							o_bmp = self.PALETTE+self.bdat[len(t_hdr)+cf*t_width*t_height:len(t_hdr)+cf*64*64].tobytes()
-					else:
+					cf = t_len//(t_width*t_height) if t_width*t_height > 0 else 0
+					if cf not in [1, 2, 3, 4]:
 						self.b_log(sys.stderr, False, 3, "Unexpected bpp (%d) found during processing; aborting." % (8*cf))
-						return False
+						return
 					bl = cf*64*64
+					rec = BMCRecord(idx, off, key1, key2, t_width, t_height, 8*cf, cf*t_width*t_height, False, hs+bl)
+			yield rec
+			off+=rec.stride
+			idx+=1
+		self.bres = True
+	def b_candidates(self, start, end):
+		if np is not None:
+			u = np.frombuffer(self.bdat, dtype="<u4", count=(end-start)//4, offset=start)
+			idx = np.flatnonzero(((u-0x00010001)&0xFFC0FFC0) == 0)
+			t_len = np.frombuffer(self.bdat, dtype="<u4", count=(len(self.bdat)-start)//4, offset=start)
+			nxt = idx+3+(u[idx]&0xFFFF)*(u[idx]>>16)
+			nxt[nxt >= len(t_len)] = 0
+			ok = ((t_len[np.minimum(idx+1, len(t_len)-1)]-1) < 0x4000)|(((t_len[nxt]-0x00010001)&0xFFC0FFC0) == 0)
+			return (idx[ok]*4+start-8).tolist()
+		return [m.start()-8 for m in self.CARVE_RE.finditer(self.bdat, start, end) if m.start()%4 == 0]
+	def b_carve_next(self, off):
+		if off+12 > len(self.bdat):
+			return off >= len(self.bdat)
+		t_width, t_height = unpack_from("<HH", self.bdat, off+8)
+		return 0 < t_width <= 64 and 0 < t_height <= 64
+	def b_carve_tile(self, off, prev, bbp):
+		if off < 0 or off+20 > len(self.bdat):
+			return None
+		key1, key2, t_width, t_height, t_len, t_params = unpack_from("<LLHHLL", self.bdat, off)
+		if not (0 < t_width <= 64 and 0 < t_height <= 64):
+			return None
+		if prev != self.BIN_CONTAINER:
+			d = off+self.TILE_HEADER_SIZE[self.BMC_CONTAINER]
+			if t_params & 0x08:
+				if 0 < t_len <= 64*64*4 and d+t_len <= len(self.bdat):
+					logs, stats = (self.logs, self.stats)
+					self.logs, self.stats = ([], None)
+					found = None
+					for cf in [bbp]+[b for b in [2, 4, 1] if b != bbp]:
+						t_bmp = self.b_uncompress(self.bdat[d:d+t_len], cf)
+						if len(t_bmp) == t_width*t_height*cf:
+							if found is None:
+								found = (cf, t_bmp)
+							if self.b_carve_next(d+64*64*cf):
+								found = (cf, t_bmp)
+								break
+					self.logs, self.stats = (logs, stats)
+					if found is not None:
+						cf, self.craw[off] = found
+						return (self.BMC_CONTAINER, BMCRecord(0, off, key1, key2, t_width, t_height, 8*cf, t_len, True, 20+64*64*cf))
+			elif t_len%(t_width*t_height) == 0 and 0 < t_len//(t_width*t_height) <= 4:
+				cf = t_len//(t_width*t_height)
+				if d+cf*64*64 <= len(self.bdat):
+					return (self.BMC_CONTAINER, BMCRecord(0, off, key1, key2, t_width, t_height, 8*cf, t_len, False, 20+64*64*cf))
+		if prev != self.BMC_CONTAINER:
+			bl = 4*t_width*t_height
+			nxt = off+self.TILE_HEADER_SIZE[self.BIN_CONTAINER]+bl
+			if nxt <= len(self.bdat) and (prev == self.BIN_CONTAINER or (nxt+12 <= len(self.bdat) and self.b_carve_next(nxt))):
+				return (self.BIN_CONTAINER, BMCRecord(0, off, key1, key2, t_width, t_height, 32, bl, False, 12+bl))
+		return None
+	def b_carve(self):
+		self.bres = False
+		sigs = set([m.start()+len(self.BIN_FILE_HEADER)+4 for m in re.finditer(re.escape(self.BIN_FILE_HEADER), self.bdat)])
+		pos = 0
+		idx = 0
+		runs = 0
+		s_time = 0.0
+		for start in range(0, len(self.bdat)-len(self.bdat)%4, self.CARVE_CHUNK):
+			t = time.perf_counter()
+			cands = self.b_candidates(start, min(start+self.CARVE_CHUNK, len(self.bdat)-len(self.bdat)%4))
+			s_time+=time.perf_counter()-t
+			for off in cands:
+				if off < pos:
+					continue
+				prev = self.BIN_CONTAINER if off in sigs else None
+				need = 1 if prev is not None else 0
+				bbp = 2
+				run = []
+				cnt = 0
+				r_off = off
+				while True:
+					res = self.b_carve_tile(off, prev, bbp)
+					if res is None:
+						break
+					prev, rec = res
+					if need == 0:
+						need = self.CARVE_RUN[prev]
+					run.append(res)
+					if cnt+len(run) >= need:
+						for self.btype, t in run:
+							yield t._replace(index=idx)
+							idx+=1
+						cnt+=len(run)
+						run = []
+					bbp = rec.bpp//8
+					off+=rec.stride
+				self.craw = {}
+				if cnt > 0:
+					self.b_log(sys.stdout, True, 2, "Run of %d %s tiles carved at offset 0x%X." % (cnt, prev.decode()[1:], r_off))
+					runs+=1
+					pos = off
+		self.b_log(sys.stdout, False, 0, "%d tiles carved in %d runs; candidate headers searched at %.1f MB/s." % (idx, runs, len(self.bdat)/max(s_time, 1e-9)/(1<<20)))
+		self.bres = True
+	def b_decode(self, rec):
+		d = rec.offset+self.TILE_HEADER_SIZE[self.btype]
+		if self.btype == self.BIN_CONTAINER:
+			return (self.b_timed("rgb32b", self.b_parse_rgb32b, self.bdat[d:d+rec.length]), b"")
+		cf = rec.bpp//8
+		if rec.compressed:
+			if rec.offset in self.craw:
+				t_bmp = self.craw.pop(rec.offset)
+			else:
+				t_bmp = self.b_timed("uncompress", self.b_uncompress, self.bdat[d:d+rec.length], cf)
 			if len(t_bmp) > 0:
-				self.bmps.append(t_bmp)
-				self.o_bmps.append(o_bmp)
-				if len(self.bmps)%100 == 0:
-					self.b_log(sys.stdout, True, 1, "%d tiles successfully extracted so far." % (len(self.bmps)))
-			self.bdat = self.bdat[len(t_hdr)+bl:]
-			if self.cnt != 0 and len(self.bmps) == self.cnt:
+				if len(t_bmp) != rec.width*rec.height*cf:
+					self.b_log(sys.stderr, False, 3, "Uncompressed tile data seems bogus (uncompressed %d bytes while expecting %d). Discarding tile." % (len(t_bmp), rec.width*rec.height*cf))
+					if self.stats is not None:
+						self.stats.bogus+=1
+					t_bmp = b""
+				else:
+					t_bmp = self.b_timed("rgb565", self.b_parse_rgb565, t_bmp)
+			return (t_bmp, b"")
+		if cf == 4:
+			stage, b_parse = ("rgb32b", self.b_parse_rgb32b)
+		elif cf == 3:
+			stage, b_parse = ("rgb24b", self.b_parse_rgb24b)
+		elif cf == 2:
+			stage, b_parse = ("rgb565", self.b_parse_rgb565)
+		else:
+			stage, b_parse = ("palette", lambda data: self.PALETTE+data.tobytes())
+		t_bmp = self.b_timed(stage, b_parse, self.bdat[d:d+rec.length])
+		o_bmp = b""
+		if rec.height != 64:
+			o_bmp = self.b_timed(stage, b_parse, self.bdat[d+rec.length:d+cf*64*64])
+		return (t_bmp, o_bmp)
+	def b_decoded(self):
+		if self.carve:
+			for rec in self.b_carve():
+				t_bmp, o_bmp = self.b_decode(rec)
+				if rec.bpp == 8 and not rec.compressed:
+					t_bmp, o_bmp = (self.b_parse_palette(t_bmp), self.b_parse_palette(o_bmp))
+				yield (rec, (t_bmp, o_bmp), [])
+			return
+		if self.tjobs <= 1:
+			for rec in self.b_scan():
+				yield (rec, self.b_decode(rec), [])
+			return
+		logs = self.logs
+		self.logs = []
+		recs = list(self.b_scan())
+		s_logs = self.logs
+		self.logs = logs
+		pool = multiprocessing.Pool(self.tjobs, decode_init, (self.verb, self.stats is not None))
+		try:
+			pending = deque()
+			for i in range(0, len(recs), self.TILE_BATCH):
+				pending.append((recs[i:i+self.TILE_BATCH], pool.apply_async(decode_run, ((self.fname, recs[i:i+self.TILE_BATCH]), ))))
+				while len(pending) > 2*self.tjobs or (len(pending) > 0 and i+self.TILE_BATCH >= len(recs)):
+					batch, res = pending.popleft()
+					res, stats = res.get()
+					if stats is not None:
+						self.stats.b_merge(stats)
+					for rec, (t_bmp, o_bmp, t_logs) in zip(batch, res):
+						yield (rec, (t_bmp, o_bmp), t_logs)
+		finally:
+			pool.terminate()
+			pool.join()
+		self.b_replay(s_logs)
+	def b_tiles(self):
+		cnt = 0
+		for rec, (t_bmp, o_bmp), t_logs in self.b_decoded():
+			self.b_replay(t_logs)
+			if rec.bpp == 8 and not rec.compressed and not self.carve:
+				self.pal = True
+			if self.stats is not None:
+				self.stats.b_tile(self.btype, rec, len(t_bmp) > 0)
+			if len(t_bmp) > 0:
+				self.rec = (self.btype, rec)
+				yield BMCTile(cnt, rec.offset, rec.key1, rec.key2, rec.width, rec.height, rec.bpp, t_bmp, o_bmp)
+				cnt+=1
+				if cnt%100 == 0:
+					self.b_log(sys.stdout, True, 1, "%d tiles successfully extracted so far." % (cnt))
+			if self.cnt != 0 and cnt == self.cnt:
+				self.bres = True
+				break
+		if self.bres:
+			self.b_log(sys.stdout, False, 0, "%d tiles successfully extracted in the end." % (cnt))
+	def b_index_db(self):
+		if self.idb is None:
+			self.idb = sqlite3.connect(self.index, timeout=60)
+			self.idb.execute("CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, container TEXT, complete INTEGER)")
+			self.idb.execute("CREATE TABLE IF NOT EXISTS tiles (source TEXT, idx INTEGER, offset INTEGER, key1 INTEGER, key2 INTEGER, width INTEGER, height INTEGER, bpp INTEGER, length INTEGER, compressed INTEGER, stride INTEGER, old INTEGER, PRIMARY KEY (source, idx))")
+			self.idb.execute("CREATE INDEX IF NOT EXISTS tiles_keys ON tiles (key1, key2)")
+			self.idb.commit()
+		return self.idb
+	def b_index(self):
+		clk = self.stats.b_clock() if self.stats is not None else None
+		src = os.path.abspath(self.fname)
+		st = os.stat(self.fname)
+		db = self.b_index_db()
+		with db:
+			db.execute("DELETE FROM tiles WHERE source = ?", (src, ))
+			db.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", ((src, )+tuple(rec)+(int(self.btype == self.BMC_CONTAINER and not rec.compressed and rec.height != 64), ) for rec in self.b_scan()))
+			db.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?)", (src, st.st_size, st.st_mtime_ns, self.btype.decode(), int(self.bres)))
+		cnt = db.execute("SELECT COUNT(*) FROM tiles WHERE source = ?", (src, )).fetchone()[0]
+		self.b_log(sys.stdout, False, 0, "%d tiles indexed in '%s'." % (cnt, self.index))
+		if clk is not None:
+			self.stats.b_stage("index", clk, len(self.bdat), 0)
+		return self.bres
+	def b_records(self, filters=None):
+		if self.index is not None and os.path.isfile(self.index):
+			src = os.path.abspath(self.fname)
+			st = os.stat(self.fname)
+			db = self.b_index_db()
+			if db.execute("SELECT 1 FROM sources WHERE source = ? AND size = ? AND mtime = ?", (src, st.st_size, st.st_mtime_ns)).fetchone() is not None:
+				self.b_log(sys.stdout, True, 2, "Using tile index '%s'." % (self.index))
+				q = "SELECT idx, offset, key1, key2, width, height, bpp, length, compressed, stride FROM tiles WHERE source = ?"
+				params = [src]
+				if filters is not None:
+					q+=" AND ("+" OR ".join(["("+" AND ".join(["%s BETWEEN ? AND ?" % ("idx" if f == "index" else f) for f, lo, hi in flt])+")" for flt in filters])+")"
+					for flt in filters:
+						for f, lo, hi in flt:
+							params+=[lo, min(hi, 2**63-1)]
+				for row in db.execute(q+" ORDER BY idx", params):
+					yield BMCRecord(*(row[:8]+(bool(row[8]), row[9])))
+				self.bres = True
+				return
+		for rec in self.b_scan():
+			if filters is None or any([all([lo <= getattr(rec, f) <= hi for f, lo, hi in flt]) for flt in filters]):
+				yield rec
+	def b_extract(self, dname):
+		if not os.path.isdir(dname):
+			self.b_log(sys.stderr, False, 3, "Destination must be an already existing folder.")
+			return False
+		clk = self.stats.b_clock() if self.stats is not None else None
+		bname = self.b_open_bundle(dname)
+		cnt = 0
+		for rec in self.b_records(self.select):
+			if rec.bpp == 8 and not rec.compressed:
+				self.pal = True
+			t_bmp, o_bmp = self.b_decode(rec)
+			if self.stats is not None:
+				self.stats.b_tile(self.btype, rec, len(t_bmp) > 0)
+			if len(t_bmp) > 0:
+				self.b_export_tile(bname, rec.index, t_bmp, o_bmp, rec)
+				cnt+=1
+			if self.cnt != 0 and cnt == self.cnt:
 				break
-		self.b_log(sys.stdout, False, 0, "%d tiles successfully extracted in the end." % (len(self.bmps)))
+		self.ecnt = cnt
+		self.b_close_bundle()
+		self.b_writer_drain()
+		self.b_log(sys.stdout, False, 0, "Successfully exported %d selected files." % (cnt))
+		if clk is not None:
+			self.stats.b_stage("extract", clk, len(self.bdat), 0)
 		return True
+	def b_process(self):
+		clk = self.stats.b_clock() if self.stats is not None else None
+		for t in self.b_tiles():
+			self.bmps.append(t.data)
+			self.o_bmps.append(t.old)
+		if clk is not None:
+			self.stats.b_stage("process", clk, len(self.bdat), sum([len(b) for b in self.bmps+self.o_bmps]))
+		return self.bres
+	def b_rgb565_lut(self):
+		if BMCContainer.RGB565_LUT is None:
+			BMCContainer.RGB565_LUT = b"".join([bytes(bytearray((((p<<3)&0xF8)|((p>>2)&0x07), ((p>>3)&0xFC)|((p>>9)&0x03), ((p>>8)&0xF8)|((p>>13)&0x07), 255))) for p in range(0x10000)])
+		return BMCContainer.RGB565_LUT
+	def b_flip_rows(self, data):
+		rl = 64*4
+		return b"".join([data[i:i+rl] for i in range(len(data)-len(data)%rl-rl, -1, -rl)])
 	def b_parse_rgb565(self, data):
-		d_out = b""
-		while len(data) > 0:
-			pxl = unpack("<H", data[:2])[0]
-			bl = ((pxl>>8)&0xF8)|((pxl>>13)&0x07)
-			gr = ((pxl>>3)&0xFC)|((pxl>>9)&0x03)
-			re = ((pxl<<3)&0xF8)|((pxl>>2)&0x07)
-			d_out+=bytearray((re, gr, bl, 255))
-			data = data[2:]
-		return bytes(d_out)
+		n = len(data)//2
+		lut = self.b_rgb565_lut()
+		if np is not None:
+			if BMCContainer.RGB565_NP is None:
+				BMCContainer.RGB565_NP = np.frombuffer(lut, dtype=np.uint8).reshape(-1, 4)
+			return BMCContainer.RGB565_NP[np.frombuffer(data, dtype="<u2", count=n)].tobytes()
+		pxl = array("H", bytes(data[:2*n]))
+		if sys.byteorder != "little":
+			pxl.byteswap()
+		return b"".join([lut[4*p:4*p+4] for p in pxl])
 	def b_parse_rgb32b(self, data):
-		d_out = b""
-		d_buf = b""
-		while len(data) > 0:
-			if self.btype == self.BIN_CONTAINER:
-				d_buf+=data[:3]+b"\xFF"
-				if len(d_buf) == 256:
-					d_out = d_buf+d_out
-					d_buf = b""
-			else:
-				d_out+=data[:3]+b"\xFF"
-			data = data[4:]
-		return d_out
+		n = len(data)&~3
+		d_out = bytearray(data[:n])
+		d_out[3::4] = self.COLOR_WHITE*(n//4)
+		if n < len(data):
+			d_out+=bytes(data[n:n+3])+self.COLOR_WHITE
+		if self.btype == self.BIN_CONTAINER:
+			return self.b_flip_rows(bytes(d_out))
+		return bytes(d_out)
 	def b_parse_rgb24b(self, data):
-		d_out = b""
-		d_buf = b""
-		while len(data) > 0:
+		n = len(data)-len(data)%3
+		if np is not None:
+			d_out = np.empty((n//3, 4), dtype=np.uint8)
+			d_out[:, :3] = np.frombuffer(data, dtype=np.uint8, count=n).reshape(-1, 3)
+			d_out[:, 3] = 255
+			if n < len(data):
+				d_out = np.append(d_out.reshape(-1), np.frombuffer(bytes(data[n:])+self.COLOR_WHITE, dtype=np.uint8))
 			if self.btype == self.BIN_CONTAINER:
-				d_buf+=data[:3]+b"\xFF"
-				if len(d_buf) == 256:
-					d_out = d_buf+d_out
-					d_buf = b""
-			else:
-				d_out+=data[:3]+b"\xFF"
-			data = data[3:]
-		return d_out
-	def b_unrle(self, data):
-		if len(data) == 0:
-			return (-1, 1, 0)
-		x = ord(data[0:1])
-		if (x&0xF0) == 0xF0:
-			if x in [0xF5, 0xFB, 0xFC, 0xFF]:
-				return (-1, 2, x)
-			elif x in [0xFD, 0xFE]:
-				return (x, 0, 1)
-			elif x in [0xF9, 0xFA]:
-				return (x, 8, 1)
-			elif len(data) < 3:
-				return (-1, 1, 0)
-			else:
-				c = unpack("<H", data[1:3])[0]
-				return (x, c, 3)
-		elif (x&0xE0) == 0xA0:
-			return (-1, 2, x)
-		else:
-			if (x&0x80) == 0x00 or (x&0xE0) == 0x80:
-				c = x&0x1F
-				x = x&0xE0
-				o = 32
-			else:
-				c = x&0x0F
-				x = x&0xF0
-				o = 16
-			if x in [0x40, 0xD0]:
-				c*=8
-				o = 1
-			if c == 0:
-				if len(data) < 2:
-					return (-1, 1, 0)
+				return self.b_flip_rows(d_out.tobytes())
+			return d_out.tobytes()
+		d_out = bytearray(4*(n//3))
+		for i in range(3):
+			d_out[i::4] = data[i:n:3]
+		d_out[3::4] = self.COLOR_WHITE*(n//3)
+		if n < len(data):
+			d_out+=bytes(data[n:])+self.COLOR_WHITE
+		if self.btype == self.BIN_CONTAINER:
+			return self.b_flip_rows(bytes(d_out))
+		return bytes(d_out)
+	def b_image(self, t):
+		btype, rec = self.rec
+		bmp, o_bmp = (t.data, t.old if self.oldsave else b"")
+		if rec.bpp == 8 and not rec.compressed and not self.carve:
+			bmp, o_bmp = (self.b_parse_palette(bmp), self.b_parse_palette(o_bmp) if len(o_bmp) > 0 else b"")
+		return BMCImage(t.index, t.offset, t.key1, t.key2, t.width, t.height, t.bpp, rec.compressed, self.b_rgba(bmp), self.b_rgba(o_bmp) if len(o_bmp) > 0 else None)
+	def b_rgba(self, data):
+		rows = len(data)//256
+		if np is not None:
+			return memoryview(np.ascontiguousarray(np.frombuffer(data, dtype=np.uint8, count=rows*256).reshape(rows, 64, 4)[::-1, :, [2, 1, 0, 3]]))
+		d_out = bytearray(self.b_flip_rows(bytes(data[:rows*256])))
+		d_out[0::4], d_out[2::4] = (d_out[2::4], d_out[0::4])
+		return memoryview(d_out).cast("B", (rows, 64, 4))
+	def b_parse_palette(self, data):
+		lut = bytearray(self.PALETTE)
+		lut[3::4] = self.COLOR_WHITE*(len(lut)//4)
+		data = data[len(self.PALETTE):]
+		if np is not None:
+			return np.frombuffer(bytes(lut), dtype=np.uint8).reshape(-1, 4)[np.frombuffer(data, dtype=np.uint8)].tobytes()
+		return b"".join([bytes(lut[4*p:4*p+4]) for p in bytearray(data)])
+	def b_rle_table(self):
+		if BMCContainer.RLE_TABLE is None:
+			fams = {0x00: self.RLE_BG, 0x20: self.RLE_FG, 0x40: self.RLE_MASK, 0x60: self.RLE_COLOR, 0x80: self.RLE_RAW, 0xC0: self.RLE_FG, 0xD0: self.RLE_MASK, 0xE0: self.RLE_DITHER, 0xF0: self.RLE_BG, 0xF1: self.RLE_FG, 0xF2: self.RLE_MASK, 0xF3: self.RLE_COLOR, 0xF4: self.RLE_RAW, 0xF6: self.RLE_FG, 0xF7: self.RLE_MASK, 0xF8: self.RLE_DITHER, 0xF9: self.RLE_MASK, 0xFA: self.RLE_MASK, 0xFD: self.RLE_WHITE, 0xFE: self.RLE_BLACK}
+			tbl = []
+			for x in range(0x100):
+				if (x&0xF0) == 0xF0:
+					if x in [0xF5, 0xFB, 0xFC, 0xFF]:
+						tbl.append((-1, x, 0, 0, 0))
+					elif x in [0xFD, 0xFE]:
+						tbl.append((fams[x], x, 0, 1, 0))
+					elif x in [0xF9, 0xFA]:
+						tbl.append((fams[x], x, 8, 1, 0))
+					else:
+						tbl.append((fams[x], x, 0, 3, 0))
+				elif (x&0xE0) == 0xA0:
+					tbl.append((-1, x, 0, 0, 0))
 				else:
-					c = ord(data[1:2])+o
-				o = 2
-			else:
-				o = 1
-			return (x, c, o)
-		return (-1, 3, 0)
+					if (x&0x80) == 0x00 or (x&0xE0) == 0x80:
+						c = x&0x1F
+						cmd = x&0xE0
+						o = 32
+					else:
+						c = x&0x0F
+						cmd = x&0xF0
+						o = 16
+					if cmd in [0x40, 0xD0]:
+						c*=8
+						o = 1
+					if c == 0:
+						tbl.append((fams[cmd], cmd, 0, 2, o))
+					else:
+						tbl.append((fams[cmd], cmd, c, 1, 0))
+			BMCContainer.RLE_TABLE = tuple(tbl)
+			BMCContainer.RLE_BITS = tuple([bytes(bytearray([(m>>j)&0x1 for j in range(8)])) for m in range(0x100)])
+		return BMCContainer.RLE_TABLE
+	def b_xor(self, data, pattern):
+		return (int.from_bytes(data, "little")^int.from_bytes(pattern, "little")).to_bytes(len(data), "little")
 	def b_uncompress(self, data, bbp):
-		d_out = b""
+		tbl = self.b_rle_table()
+		data = bytearray(data)
+		dlen = len(data)
+		row = 64*bbp
+		d_out = bytearray(64*row)
+		pos = 0
 		bro = -1
-		fgc = self.COLOR_WHITE*bbp
-		while len(data) > 0:
-			cmd, rl, sz = self.b_unrle(data[:3])
-			if cmd == -1:
-				if rl == 1:
-					self.b_log(sys.stderr, False, 3, "Unexpected end of compressed stream. Skipping tile.")
-				elif rl == 2:
-					self.b_log(sys.stderr, False, 3, "Unexpected decompression command encountered (0x%02X). Skipping tile." % (sz))
-				else:
-					self.b_log(sys.stderr, False, 3, "Unhandled case in decompression routine. Skipping tile.")
+		fgc = bytearray(self.COLOR_WHITE*bbp)
+		blk = self.COLOR_BLACK*bbp
+		ops = self.stats.opcodes if self.stats is not None else None
+		i = 0
+		while i < dlen:
+			fam, cmd, rl, sz, o = tbl[data[i]]
+			if ops is not None:
+				ops[cmd]+=1
+			if fam == -1:
+				self.b_log(sys.stderr, False, 3, "Unexpected decompression command encountered (0x%02X). Skipping tile." % (cmd))
+				return b""
+			elif i+sz > dlen:
+				self.b_log(sys.stderr, False, 3, "Unexpected end of compressed stream. Skipping tile.")
 				return b""
-			data = data[sz:]
-			if cmd in [0x00, 0xF0]:
-				if len(d_out) < 64*bbp:
+			elif sz == 2:
+				rl = data[i+1]+o
+			elif sz == 3:
+				rl = data[i+1]|(data[i+2]<<8)
+			i+=sz
+			if fam == self.RLE_BG:
+				if pos < row:
 					if bro == 0:
-						d_out+=fgc
+						d_out[pos:pos+bbp] = fgc
+						pos+=bbp
 						rl-=1
-					d_out+=(self.COLOR_BLACK*bbp)*rl
+					if rl > 0:
+						d_out[pos:pos+rl*bbp] = blk*rl
+						pos+=rl*bbp
 				else:
 					if bro > 0:
-						c = d_out[-64*bbp:][:bbp]
-						for i in range(bbp):
-							d_out+=bytearray((ord(c[i:i+1])^ord(fgc[i:i+1]), ))
+						d_out[pos:pos+bbp] = self.b_xor(d_out[pos-row:pos-row+bbp], fgc)
+						pos+=bbp
 						rl-=1
-					while rl > 0:
-						d_out+=d_out[-64*bbp:][:bbp]
-						rl-=1
-				bro = len(d_out)//(64*bbp)
-			elif cmd in [0x20, 0xC0, 0xF1, 0xF6]:
+					sz = rl*bbp
+					while sz > 0:
+						c = min(sz, row)
+						d_out[pos:pos+c] = d_out[pos-row:pos-row+c]
+						pos+=c
+						sz-=c
+				bro = pos//row
+				continue
+			elif fam == self.RLE_FG:
 				if cmd in [0xC0, 0xF6]:
-					if len(data) < bbp:
-						self.b_log(sys.stderr, False, 3, "Unexpected end of compressed stream. Skipping tile." % (cmd, rl))
+					if i+bbp > dlen:
+						self.b_log(sys.stderr, False, 3, "Unexpected end of compressed stream. Skipping tile.")
 						return b""
-					fgc = data[:bbp]
-					data = data[bbp:]
-				if len(d_out) < 64*bbp:
-					d_out+=fgc*rl
+					fgc = data[i:i+bbp]
+					i+=bbp
+				if pos < row:
+					d_out[pos:pos+rl*bbp] = fgc*rl
+					pos+=rl*bbp
 				else:
-					while rl > 0:
-						c = d_out[-64*bbp:][:bbp]
-						for i in range(bbp):
-							d_out+=bytearray((ord(c[i:i+1])^ord(fgc[i:i+1]), ))
-						rl-=1
-			elif cmd in [0xE0, 0xF8]:
-				if len(data) < 2*bbp:
+					sz = rl*bbp
+					while sz > 0:
+						c = min(sz, row)
+						d_out[pos:pos+c] = self.b_xor(d_out[pos-row:pos-row+c], fgc*(c//bbp))
+						pos+=c
+						sz-=c
+			elif fam == self.RLE_DITHER:
+				if i+2*bbp > dlen:
 					self.b_log(sys.stderr, False, 3, "Unexpected end of compressed stream. Skipping tile.")
 					return b""
-				d_out+=data[:2*bbp]*rl
-				data = data[2*bbp:]
-			elif cmd in [0x60, 0xF3]:
-				if len(data) < bbp:
+				d_out[pos:pos+2*bbp*rl] = data[i:i+2*bbp]*rl
+				pos+=2*bbp*rl
+				i+=2*bbp
+			elif fam == self.RLE_COLOR:
+				if i+bbp > dlen:
 					self.b_log(sys.stderr, False, 3, "Unexpected end of compressed stream. Skipping tile.")
 					return b""
-				d_out+=data[:bbp]*rl
-				data = data[bbp:]
-			elif cmd in [0x40, 0xD0, 0xF2, 0xF7, 0xF9, 0xFA]:
+				d_out[pos:pos+bbp*rl] = data[i:i+bbp]*rl
+				pos+=bbp*rl
+				i+=bbp
+			elif fam == self.RLE_MASK:
 				if cmd in [0xD0, 0xF7]:
-					if len(data) < bbp:
+					if i+bbp > dlen:
 						self.b_log(sys.stderr, False, 3, "Unexpected end of compressed stream. Skipping tile.")
 						return b""
-					fgc = data[:bbp]
-					data = data[bbp:]
+					fgc = data[i:i+bbp]
+					i+=bbp
 				if cmd == 0xF9:
-					msk = b"\x03"
-					ml = 1
+					msk = bytearray(b"\x03")
 				elif cmd == 0xFA:
-					msk = b"\x05"
-					ml = 1
+					msk = bytearray(b"\x05")
 				else:
-					if (rl%8) != 0:
-						ml = (rl//8)+1
-					else:
-						ml = rl//8
-					if len(data) < ml:
+					ml = (rl+7)//8
+					if i+ml > dlen:
 						self.b_log(sys.stderr, False, 3, "Unexpected end of compressed stream. Skipping tile.")
 						return b""
-					msk = data[:ml]
-					data = data[ml:]
+					msk = data[i:i+ml]
+					i+=ml
 				k = 0
-				while rl > 0:
-					if (k%8) == 0:
-						m = ord(msk[k//8:][:1])
-					b = m&(0x1<<(k%8))
-					if len(d_out) < 64*bbp:
-						if b == 0:
-							d_out+=(self.COLOR_BLACK*bbp)
-						else:
-							d_out+=fgc
+				while k < rl:
+					if pos < row:
+						c = min(rl-k, (row-pos)//bbp)
 					else:
-						c = d_out[-64*bbp:][:bbp]
-						if b == 0:
-							d_out+=c
-						else:
-							for i in range(bbp):
-								d_out+=bytearray((ord(c[i:i+1])^ord(fgc[i:i+1]), ))
-					k+=1
-					rl-=1
-			elif cmd in [0x80, 0xF4]:
-				if len(data) < bbp*rl:
+						c = min(rl-k, 64)
+					sz = c*bbp
+					sel = b"".join([self.RLE_BITS[m] for m in msk[k>>3:(k+c+7)>>3]])[k&0x7:(k&0x7)+c]
+					pat = bytearray(sz)
+					for j in range(bbp):
+						pat[j::bbp] = sel.translate(bytearray((blk[j], fgc[j]))+bytearray(0xFE))
+					if pos < row:
+						d_out[pos:pos+sz] = pat
+					else:
+						d_out[pos:pos+sz] = self.b_xor(d_out[pos-row:pos-row+sz], pat)
+					pos+=sz
+					k+=c
+			elif fam == self.RLE_RAW:
+				if i+bbp*rl > dlen:
 					self.b_log(sys.stderr, False, 3, "Unexpected end of compressed stream. Skipping tile.")
 					return b""
-				d_out+=data[:rl*bbp]
-				data = data[rl*bbp:]
-			elif cmd == 0xFD:
-				d_out+=(self.COLOR_WHITE*bbp)
-			elif cmd == 0xFE:
-				d_out+=(self.COLOR_BLACK*bbp)
-			else:
-				self.b_log(sys.stderr, False, 3, "Unhandled decompression command (0x%02X). Skipping tile." % (cmd))
-				return b""
-			if cmd not in [0x00, 0xF0]:
-				bro = -1
-		return d_out
+				d_out[pos:pos+bbp*rl] = data[i:i+bbp*rl]
+				pos+=bbp*rl
+				i+=bbp*rl
+			elif fam == self.RLE_WHITE:
+				d_out[pos:pos+bbp] = self.COLOR_WHITE*bbp
+				pos+=bbp
+			elif fam == self.RLE_BLACK:
+				d_out[pos:pos+bbp] = blk
+				pos+=bbp
+			bro = -1
+		return bytes(d_out[:pos])
 	def b_export(self, dname):
 		if not os.path.isdir(dname):
 			self.b_log(sys.stderr, False, 3, "Destination must be an already existing folder.")
 			return False
-		self.fname = os.path.basename(self.fname)
+		clk = self.stats.b_clock() if self.stats is not None else None
+		bname = self.b_open_bundle(dname)
 		for i in range(len(self.bmps)):
-			self.b_write(os.path.join(dname, "%s_%04d.bmp" % (self.fname, i)), self.b_export_bmp(64, len(self.bmps[i])//256, self.bmps[i]))
-			if self.oldsave and i < len(self.o_bmps) and len(self.o_bmps[i]) > 0:
-				self.b_write(os.path.join(dname, "%s_old_%04d.bmp" % (self.fname, i)), self.b_export_bmp(64, len(self.o_bmps[i])//256, self.o_bmps[i]))
+			self.b_export_tile(bname, i, self.bmps[i], self.o_bmps[i] if i < len(self.o_bmps) else b"")
+		self.b_close_bundle()
+		self.b_writer_drain()
 		self.b_log(sys.stdout, False, 0, "Successfully exported %d files." % (len(self.bmps)))
 		if self.big:
-			pad = b"\xFF"
-			if not self.pal:
-				pad*=4
-			for i in range(len(self.bmps)):
-				if self.pal:
-					self.bmps[i] = self.bmps[i][len(self.PALETTE):]
-				while len(self.bmps[i]) < 64*64*len(pad):
-					self.bmps[i]+=pad*64
-			w = 64*len(self.bmps)
-			h = 64
-			if len(self.bmps)//self.STRIPE_WIDTH > 0:
-				m = len(self.bmps)%self.STRIPE_WIDTH
-				if m != 0:
-					for i in range(self.STRIPE_WIDTH-m):
-						self.bmps.append(pad*64*64)
-				w = self.STRIPE_WIDTH*64
-				h*=len(self.bmps)//self.STRIPE_WIDTH
-			c_bmp = b"" if not self.pal else self.PALETTE
-			if self.btype == self.BIN_CONTAINER:
-				collage_builder = (lambda x, a=self, PAD=len(pad), WIDTH=range(w // 64): b''.join([b''.join([a.bmps[a.STRIPE_WIDTH*(x+1)-1-k][64*PAD*j:64*PAD*(j+1)] for k in WIDTH]) for j in range(64)]))
-			else:
-				collage_builder = (lambda x, a=self, PAD=len(pad), WIDTH=range(w // 64): b''.join([b''.join([a.bmps[a.STRIPE_WIDTH*x+k][64*PAD*j:64*PAD*(j+1)] for k in WIDTH]) for j in range(64)]))
-			c_bmp += b''.join(map(collage_builder, range(h//64)))
-			self.b_write(os.path.join(dname, "%s_collage.bmp" % (self.fname)), self.b_export_bmp(w, h, c_bmp))
-			self.b_log(sys.stdout, False, 0, "Successfully exported collage file.")
-		return True
-	def b_export_bmp(self, width, height, data):
-		if not self.pal:
-			return b"BM"+pack("<L", len(data)+122)+b"\x00\x00\x00\x00\x7A\x00\x00\x00\x6C\x00\x00\x00"+pack("<L", width)+pack("<L", height)+b"\x01\x00\x20\x00\x03\x00\x00\x00"+pack("<L", len(data))+b"\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xFF\x00\x00\xFF\x00\x00\xFF\x00\x00\x00\x00\x00\x00\xFF niW"+(b"\x00"*36)+b"\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00"+data
+			self.b_export_collage(dname)
+		if clk is not None:
+			self.stats.b_stage("export", clk, 0, 0)
+		return True
+	def b_stream(self, dname):
+		if not os.path.isdir(dname):
+			self.b_log(sys.stderr, False, 3, "Destination must be an already existing folder.")
+			return False
+		clk = self.stats.b_clock() if self.stats is not None else None
+		cnt = 0
+		self.dcnt = 0
+		collage = None
+		if self.big:
+			collage = BMCCollage(self, os.path.join(dname, "%s_collage.bmp" % (os.path.basename(self.fname))))
+		stitcher = None
+		if self.stitch:
+			stitcher = BMCStitcher(self)
+		bname = self.b_open_bundle(dname)
+		for t in self.b_tiles():
+			self.b_export_tile(bname, t.index, t.data, t.old, t)
+			if collage is not None:
+				collage.b_add(t.data)
+			if stitcher is not None:
+				stitcher.b_add(t.data, self.rec)
+			cnt+=1
+		self.ecnt = cnt
+		if stitcher is not None:
+			stitcher.b_close(bname)
+		self.b_close_bundle()
+		self.b_writer_drain()
+		self.b_log(sys.stdout, False, 0, "Successfully exported %d files." % (cnt))
+		if self.dedup is not None:
+			self.b_log(sys.stdout, False, 0, "%d bitmaps were duplicates of already exported ones and have not been written again." % (self.dcnt))
+		if collage is not None:
+			collage.b_close()
+		if clk is not None:
+			self.stats.b_stage("export", clk, len(self.bdat), 0)
+		return True
+	def b_open_bundle(self, dname):
+		if self.bundle is None:
+			return dname
+		self.out = BMCBundle(self, os.path.join(dname, "%s.%s" % (os.path.basename(self.fname), self.bundle)))
+		return self.out.fname
+	def b_close_bundle(self):
+		if self.out is not None:
+			self.out.b_close()
+			self.out = None
+		return True
+	def b_export_tile(self, dname, i, bmp, o_bmp, tile=None):
+		bname = os.path.basename(self.fname)
+		self.b_write_tile(os.path.join(dname, "%s_%04d.%s" % (bname, i, self.fmt)), bmp, tile, False)
+		if self.oldsave and len(o_bmp) > 0:
+			self.b_write_tile(os.path.join(dname, "%s_old_%04d.%s" % (bname, i, self.fmt)), o_bmp, tile, True)
+		return True
+	def b_write_tile(self, fname, bmp, tile=None, old=False):
+		stored = fname
+		if self.dedup is not None:
+			digest = hashlib.blake2b(bmp, digest_size=16).hexdigest()
+			if self.out is not None:
+				digest = (self.out.fname, digest)
+			stored = self.dedup.setdefault(digest, fname)
+			if stored == fname:
+				prev = self.dedup.get(("path", fname), digest)
+				if prev != digest and self.dedup.get(prev) == fname:
+					del self.dedup[prev]
+				self.dedup[("path", fname)] = digest
+			self.dmap.append((self.fname, fname, stored))
+		if self.out is not None:
+			self.out.b_meta(fname, stored, tile, old)
+		if stored != fname:
+			self.dcnt+=1
+			return True
+		if self.writers > 0 and self.out is None:
+			if self.wq is None:
+				self.b_writer_start()
+			self.wq.put((fname, bmp, self.pal))
+			self.last = fname
+			return True
+		return self.b_write(fname, self.b_encode(bmp))
+	def b_encode(self, bmp, pal=None):
+		if self.fmt == "png":
+			return self.b_export_png(bmp, pal)
+		return self.b_export_bmp(64, len(bmp)//256, bmp, pal)
+	def b_writer_start(self):
+		self.wq = queue.Queue(4*self.writers)
+		for i in range(self.writers):
+			t = threading.Thread(target=self.b_writer_run)
+			t.daemon = True
+			t.start()
+		return True
+	def b_writer_run(self):
+		while True:
+			fname, bmp, pal = self.wq.get()
+			try:
+				if self.werr is None:
+					self.b_write(fname, self.b_encode(bmp, pal))
+			except Exception as e:
+				self.werr = e
+			finally:
+				self.wq.task_done()
+	def b_writer_drain(self):
+		if self.wq is not None:
+			self.wq.join()
+		if self.werr is not None:
+			e = self.werr
+			self.werr = None
+			raise e
+		return True
+	def b_export_collage(self, dname):
+		collage = BMCCollage(self, os.path.join(dname, "%s_collage.bmp" % (os.path.basename(self.fname))))
+		for bmp in self.bmps:
+			collage.b_add(bmp)
+		return collage.b_close()
+	def b_bmp_header(self, width, height, size, pal=None):
+		if not (self.pal if pal is None else pal):
+			return b"BM"+pack("<L", size+122)+b"\x00\x00\x00\x00\x7A\x00\x00\x00\x6C\x00\x00\x00"+pack("<L", width)+pack("<L", height)+b"\x01\x00\x20\x00\x03\x00\x00\x00"+pack("<L", size)+b"\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xFF\x00\x00\xFF\x00\x00\xFF\x00\x00\x00\x00\x00\x00\xFF niW"+(b"\x00"*36)+b"\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+		else:
+			return b"BM"+pack("<L", size+0x36)+b"\x00\x00\x00\x00\x36\x04\x00\x00\x28\x00\x00\x00"+pack("<L", width)+pack("<L", height)+b"\x01\x00\x08\x00\x00\x00\x00\x00"+pack("<L", size-0x400)+b"\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+	def b_export_bmp(self, width, height, data, pal=None):
+		return self.b_bmp_header(width, height, len(data), pal)+data
+	def b_export_png(self, data, pal=None, width=64):
+		pal = self.pal if pal is None else pal
+		if pal:
+			plte = bytearray(3*256)
+			for i in range(3):
+				plte[i::3] = self.PALETTE[2-i::4]
+			data = data[len(self.PALETTE):]
+			ctype, rl = (3, width)
 		else:
-			return b"BM"+pack("<L", len(data)+0x36)+b"\x00\x00\x00\x00\x36\x04\x00\x00\x28\x00\x00\x00"+pack("<L", width)+pack("<L", height)+b"\x01\x00\x08\x00\x00\x00\x00\x00"+pack("<L", len(data)-0x400)+b"\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00"+data
+			d_out = bytearray(data)
+			d_out[0::4] = data[2::4]
+			d_out[2::4] = data[0::4]
+			data = bytes(d_out)
+			ctype, rl = (6, width*4)
+		height = len(data)//rl
+		raw = b"".join([b"\x00"+data[i:i+rl] for i in range((height-1)*rl, -1, -rl)])
+		png = b"\x89PNG\r\n\x1a\n"+self.b_png_chunk(b"IHDR", pack(">LLBBBBB", width, height, 8, ctype, 0, 0, 0))
+		if pal:
+			png+=self.b_png_chunk(b"PLTE", bytes(plte))
+		return png+self.b_png_chunk(b"IDAT", zlib.compress(raw))+self.b_png_chunk(b"IEND", b"")
+	def b_png_chunk(self, ctype, data):
+		return pack(">L", len(data))+ctype+data+pack(">L", zlib.crc32(ctype+data)&0xFFFFFFFF)
 	def b_write(self, fname, data):
-		with open(fname, "wb") as f:
-			f.write(data)
+		clk = self.stats.b_clock() if self.stats is not None else None
+		if self.out is not None:
+			self.out.b_add(os.path.basename(fname), data)
+		else:
+			with open(fname, "wb") as f:
+				f.write(data)
+			self.last = fname
+		if clk is not None:
+			with self.wlock:
+				self.stats.b_stage("write", clk, 0, len(data))
 		return True
 	def b_flush(self):
+		self.b_close_bundle()
+		if self.wq is not None:
+			self.wq.join()
+		self.werr = None
+		if isinstance(self.bdat, memoryview):
+			self.bdat.release()
+		if self.bmap is not None:
+			self.bmap.close()
+			self.bmap = None
 		self.bdat = ""
 		self.bmps = []
 		self.o_bmps = []
+		self.pal = False
+		self.craw = {}
 		return True
 
+class BMCCollage():
+	def __init__(self, bmcc, fname):
+		self.bmcc = bmcc
+		self.fname = fname
+		self.f = None
+		self.stripe = []
+		self.pad = None
+		self.cols = 0
+		self.rows = 0
+	def b_add(self, bmp):
+		if self.pad is None:
+			self.pad = b"\xFF" if self.bmcc.pal else b"\xFF"*4
+		if self.bmcc.pal:
+			bmp = bmp[len(self.bmcc.PALETTE):]
+		if len(bmp) < 64*64*len(self.pad):
+			bmp+=self.pad*(64*64-len(bmp)//len(self.pad))
+		self.stripe.append(bmp)
+		if len(self.stripe) == self.bmcc.STRIPE_WIDTH:
+			self.b_write_stripe()
+		return True
+	def b_header(self):
+		size = 64*64*len(self.pad)*self.cols*self.rows
+		if self.bmcc.pal:
+			return self.bmcc.b_bmp_header(64*self.cols, 64*self.rows, size+len(self.bmcc.PALETTE))+self.bmcc.PALETTE
+		return self.bmcc.b_bmp_header(64*self.cols, 64*self.rows, size)
+	def b_write_stripe(self):
+		if self.f is None:
+			self.cols = len(self.stripe)
+			self.f = open(self.fname, "wb")
+			self.f.write(self.b_header())
+		if self.bmcc.btype == self.bmcc.BIN_CONTAINER:
+			self.stripe.reverse()
+		rl = 64*len(self.pad)
+		clk = self.bmcc.stats.b_clock() if self.bmcc.stats is not None else None
+		self.f.write(b"".join([bmp[rl*j:rl*(j+1)] for j in range(64) for bmp in self.stripe]))
+		if clk is not None:
+			self.bmcc.stats.b_stage("collage", clk, 0, rl*64*len(self.stripe))
+		self.rows+=1
+		self.stripe = []
+		return True
+	def b_close(self):
+		if self.pad is None:
+			self.pad = b"\xFF" if self.bmcc.pal else b"\xFF"*4
+		if self.f is None:
+			self.b_write_stripe()
+		elif len(self.stripe) > 0:
+			while len(self.stripe) < self.cols:
+				self.stripe.append(self.pad*64*64)
+			self.b_write_stripe()
+		self.f.seek(0)
+		self.f.write(self.b_header())
+		self.f.close()
+		self.f = None
+		self.bmcc.last = self.fname
+		self.bmcc.b_log(sys.stdout, False, 0, "Successfully exported collage file.")
+		return True
+
+class BMCStitcher():
+	def __init__(self, bmcc):
+		self.bmcc = bmcc
+		self.recs = []
+		self.seen = set()
+		self.edges = [{}, {}, {}, {}]
+	def b_edges(self, bmp):
+		if np is not None:
+			a = np.frombuffer(bmp, dtype=np.uint8).reshape(64, 64, 4)
+			cols = [a[:, 0].tobytes(), a[:, 63].tobytes()]
+		else:
+			cols = [b"".join([bmp[c+j::256] for j in range(4)]) for c in [0, 63*4]]
+			cols = [b"".join([col[i::64] for i in range(64)]) for col in cols]
+		return (cols[0], cols[1], bmp[-256:], bmp[:256])
+	def b_add(self, bmp, rec):
+		if rec[1].bpp == 8 and not rec[1].compressed and not self.bmcc.carve:
+			bmp = self.bmcc.b_parse_palette(bmp)
+		if len(bmp) != 64*64*4:
+			return False
+		h = hashlib.blake2b(bmp, digest_size=16).digest()
+		if h in self.seen:
+			return False
+		self.seen.add(h)
+		i = len(self.recs)
+		self.recs.append(rec)
+		for side, edge in enumerate(self.b_edges(bmp)):
+			if edge != edge[:4]*64:
+				self.edges[side].setdefault(hashlib.blake2b(edge, digest_size=8).digest(), []).append(i)
+		return True
+	def b_links(self):
+		links = [[None]*4 for i in range(len(self.recs))]
+		for a, b, da, db in [(1, 0, 0, 1), (2, 3, 2, 3)]:
+			for h, src in self.edges[a].items():
+				dst = self.edges[b].get(h)
+				if dst is not None and len(src) == 1 and len(dst) == 1 and src[0] != dst[0]:
+					links[src[0]][da] = dst[0]
+					links[dst[0]][db] = src[0]
+		return links
+	def b_fragments(self):
+		links = self.b_links()
+		done = [False]*len(self.recs)
+		frags = []
+		for i in range(len(self.recs)):
+			if done[i]:
+				continue
+			done[i] = True
+			grid = {(0, 0): i}
+			todo = deque([(i, 0, 0)])
+			while len(todo) > 0:
+				j, x, y = todo.popleft()
+				for k, (dx, dy) in zip(links[j], [(1, 0), (-1, 0), (0, 1), (0, -1)]):
+					if k is not None and not done[k] and (x+dx, y+dy) not in grid:
+						done[k] = True
+						grid[(x+dx, y+dy)] = k
+						todo.append((k, x+dx, y+dy))
+			if len(grid) > 1:
+				frags.append(grid)
+		frags.sort(key=lambda grid: -len(grid))
+		return frags
+	def b_tile(self, i):
+		self.bmcc.btype, rec = self.recs[i]
+		bmp = self.bmcc.b_decode(rec)[0]
+		if rec.bpp == 8 and not rec.compressed:
+			bmp = self.bmcc.b_parse_palette(bmp)
+		return bmp
+	def b_close(self, dname):
+		btype = self.bmcc.btype
+		frags = self.b_fragments()
+		pad = b"\xFF"*4*64
+		for n, grid in enumerate(frags):
+			xs = [x for x, y in grid]
+			ys = [y for x, y in grid]
+			cols = max(xs)-min(xs)+1
+			tiles = dict([(pos, self.b_tile(i)) for pos, i in grid.items()])
+			data = b"".join([b"".join([tiles[(x, y)][256*r:256*(r+1)] if (x, y) in tiles else pad for x in range(min(xs), max(xs)+1)]) for y in range(min(ys), max(ys)+1) for r in range(64)])
+			fname = os.path.join(dname, "%s_screen_%04d.%s" % (os.path.basename(self.bmcc.fname), n, self.bmcc.fmt))
+			if self.bmcc.out is not None:
+				self.bmcc.out.b_meta(fname, fname, None, False, (64*cols, len(data)//(256*cols)))
+			if self.bmcc.fmt == "png":
+				self.bmcc.b_write(fname, self.bmcc.b_export_png(data, False, 64*cols))
+			else:
+				self.bmcc.b_write(fname, self.bmcc.b_export_bmp(64*cols, len(data)//(256*cols), data, False))
+		self.bmcc.btype = btype
+		self.bmcc.b_log(sys.stdout, False, 0, "%d screen fragments reconstructed from %d tiles." % (len(frags), sum([len(grid) for grid in frags])))
+		return True
+
+class BMCBundle():
+	def __init__(self, bmcc, fname):
+		self.bmcc = bmcc
+		self.fname = fname
+		self.rows = []
+		if bmcc.bundle == "zip":
+			self.f = zipfile.ZipFile(fname, "w", zipfile.ZIP_STORED if bmcc.fmt == "png" else zipfile.ZIP_DEFLATED, allowZip64=True)
+		else:
+			self.f = tarfile.open(fname, "w")
+	def b_add(self, name, data):
+		if self.bmcc.bundle == "zip":
+			self.f.writestr(name, data)
+		else:
+			info = tarfile.TarInfo(name)
+			info.size = len(data)
+			info.mtime = int(time.time())
+			self.f.addfile(info, io.BytesIO(data))
+		return True
+	def b_meta(self, fname, stored, tile, old, size=None):
+		row = [os.path.basename(fname), os.path.basename(stored), int(old)]
+		if tile is not None:
+			row+=[tile.index, tile.offset, tile.key1, tile.key2, tile.width, tile.height, tile.bpp]
+		elif size is not None:
+			row+=["", "", "", ""]+list(size)+[32]
+		self.rows.append(row)
+		return True
+	def b_close(self):
+		meta = io.StringIO()
+		w = csv.writer(meta)
+		w.writerow(("bitmap", "stored", "old", "index", "offset", "key1", "key2", "width", "height", "bpp"))
+		w.writerows(self.rows)
+		self.b_add("index.csv", meta.getvalue().encode())
+		self.f.close()
+		self.bmcc.last = self.fname
+		return True
+
+class BMCStats():
+	def __init__(self):
+		self.stages = {}
+		self.tiles = {}
+		self.opcodes = [0]*0x100
+		self.discarded = 0
+		self.bogus = 0
+	def b_clock(self):
+		return (time.perf_counter(), time.process_time())
+	def b_stage(self, stage, clk, b_in, b_out):
+		s = self.stages.setdefault(stage, [0, 0.0, 0.0, 0, 0])
+		s[0]+=1
+		s[1]+=time.perf_counter()-clk[0]
+		s[2]+=time.process_time()-clk[1]
+		s[3]+=b_in
+		s[4]+=b_out
+		return True
+	def b_tile(self, btype, rec, ok):
+		k = "%s/%dbpp%s" % (btype.decode()[1:], rec.bpp, "/compressed" if rec.compressed else "")
+		self.tiles[k] = self.tiles.get(k, 0)+1
+		if not ok:
+			self.discarded+=1
+		return True
+	def b_merge(self, other):
+		for k, v in other.stages.items():
+			s = self.stages.setdefault(k, [0, 0.0, 0.0, 0, 0])
+			for i in range(len(s)):
+				s[i]+=v[i]
+		for k, v in other.tiles.items():
+			self.tiles[k] = self.tiles.get(k, 0)+v
+		for i in range(len(self.opcodes)):
+			self.opcodes[i]+=other.opcodes[i]
+		self.discarded+=other.discarded
+		self.bogus+=other.bogus
+		return True
+	def b_dict(self):
+		stages = dict([(k, dict(zip(["calls", "wall", "cpu", "bytes_in", "bytes_out"], v))) for k, v in self.stages.items()])
+		opcodes = dict([("0x%02X" % (i), c) for i, c in enumerate(self.opcodes) if c > 0])
+		return dict(stages=stages, tiles=self.tiles, opcodes=opcodes, discarded=self.discarded, bogus=self.bogus)
+
+class BMCState():
+	def __init__(self, fname, options):
+		self.db = sqlite3.connect(fname)
+		self.db.execute("CREATE TABLE IF NOT EXISTS processed (source TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, hash TEXT, version TEXT, options TEXT, status TEXT, tiles INTEGER, last TEXT)")
+		self.db.commit()
+		self.options = options
+	def b_hash(self, fname):
+		h = hashlib.blake2b()
+		with open(fname, "rb") as f:
+			for blk in iter(lambda: f.read(1<<20), b""):
+				h.update(blk)
+		return h.hexdigest()
+	def b_unchanged(self, fname):
+		src = os.path.abspath(fname)
+		row = self.db.execute("SELECT size, mtime, hash, last FROM processed WHERE source = ? AND version = ? AND options = ? AND status = 'done'", (src, BMCContainer.VERSION, self.options)).fetchone()
+		if row is None or (len(row[3]) > 0 and not os.path.isfile(row[3])):
+			return False
+		st = os.stat(fname)
+		if row[0] != st.st_size:
+			return False
+		elif row[1] != st.st_mtime_ns:
+			if self.b_hash(fname) != row[2]:
+				return False
+			with self.db:
+				self.db.execute("UPDATE processed SET mtime = ? WHERE source = ?", (st.st_mtime_ns, src))
+		return True
+	def b_start(self, fname):
+		st = os.stat(fname)
+		with self.db:
+			self.db.execute("INSERT OR REPLACE INTO processed VALUES (?, ?, ?, NULL, ?, ?, 'running', 0, '')", (os.path.abspath(fname), st.st_size, st.st_mtime_ns, BMCContainer.VERSION, self.options))
+		return True
+	def b_done(self, fname, ok, tiles, last, fhash):
+		with self.db:
+			self.db.execute("UPDATE processed SET status = ?, tiles = ?, last = ?, hash = ? WHERE source = ?", ("done" if ok else "failed", tiles, os.path.abspath(last) if len(last) > 0 else "", fhash, os.path.abspath(fname)))
+		return True
+
+class BMCClient(socketserver.StreamRequestHandler):
+	def handle(self):
+		self.idle = threading.Condition(threading.RLock())
+		self.pending = 0
+		for line in self.rfile:
+			line = line.decode("utf-8", "replace").strip()
+			if len(line) == 0:
+				continue
+			try:
+				req = json.loads(line) if line.startswith("{") else dict(src=line)
+				job = (str(req["src"]), req.get("dest"), int(req.get("priority", 0)), self)
+			except (ValueError, KeyError, TypeError, AttributeError):
+				self.b_send(dict(ok=False, error="invalid job '%s'" % (line)))
+				continue
+			with self.idle:
+				self.pending+=1
+			self.server.service.incoming.put(job)
+		with self.idle:
+			while self.pending > 0:
+				self.idle.wait()
+	def b_send(self, res):
+		with self.idle:
+			try:
+				self.wfile.write((json.dumps(res, sort_keys=True)+"\n").encode("utf-8"))
+				self.wfile.flush()
+			except OSError:
+				pass
+		return True
+	def b_done(self, res):
+		with self.idle:
+			self.b_send(res)
+			self.pending-=1
+			self.idle.notify_all()
+		return True
+
+class BMCService():
+	POLL = 1.0
+	REPORT = 60.0
+	UNIX = hasattr(socketserver, "ThreadingUnixStreamServer")
+	def __init__(self, bmcc, init, jobs, dest, kape, carve, inboxes=None, listen=None, state=None, force=False, d_map=None, f_stats=None):
+		self.bmcc = bmcc
+		self.init = init
+		self.pool = None
+		self.jobs = jobs
+		self.dest = dest
+		self.kape = kape
+		self.carve = carve
+		self.inboxes = inboxes or []
+		self.listen = listen
+		self.state = state
+		self.force = force
+		self.d_map = d_map
+		self.f_stats = f_stats
+		self.heap = []
+		self.seq = 0
+		self.seen = {}
+		self.running = {}
+		self.incoming = queue.Queue()
+		self.done = queue.Queue()
+		self.stop = threading.Event()
+		self.server = None
+		self.f_cnt = 0
+		self.f_ok = 0
+		self.t_cnt = 0
+		self.window = [time.perf_counter(), 0, 0, 0]
+	def b_submit(self, src, dest=None, prio=0, client=None):
+		self.seq+=1
+		job = dict(id=self.seq, src=src, dest=dest or self.dest, prio=prio, client=client, queued=time.perf_counter(), size=0)
+		if not os.path.isfile(src):
+			return self.b_reject(job, "file not found")
+		elif not os.path.isdir(job["dest"]):
+			return self.b_reject(job, "destination folder not found")
+		elif not self.b_inside(job["dest"]):
+			return self.b_reject(job, "destination folder outside of '%s'" % (self.dest))
+		job["size"] = os.path.getsize(src)
+		heapq.heappush(self.heap, (-prio, self.seq, job))
+		self.bmcc.b_log(sys.stdout, True, 2, "Job %d queued with priority %d: '%s' (%d pending)." % (job["id"], prio, src, len(self.heap)))
+		return True
+	def b_inside(self, dname):
+		root = os.path.realpath(self.dest)
+		try:
+			return os.path.commonpath([root, os.path.realpath(dname)]) == root
+		except ValueError:
+			return False
+	def b_reply(self, job, res):
+		if job["client"] is not None:
+			job["client"].b_done(dict(job=job["id"], source=job["src"], **res))
+		return res["ok"]
+	def b_reject(self, job, error):
+		if job["client"] is None:
+			self.bmcc.b_log(sys.stderr, False, 3, "Job %d rejected, %s: '%s'." % (job["id"], error, job["src"]))
+		return self.b_reply(job, dict(ok=False, error=error))
+	def b_dispatch(self):
+		while len(self.heap) > 0 and len(self.running) < self.jobs:
+			job = heapq.heappop(self.heap)[2]
+			if self.state is not None and not self.force and self.state.b_unchanged(job["src"]):
+				self.bmcc.b_log(sys.stdout, False, 2, "File '%s' already processed and unchanged, skipped." % (job["src"]))
+				self.b_reply(job, dict(ok=True, skipped=True, exported=0))
+				continue
+			elif self.state is not None:
+				self.state.b_start(job["src"])
+			job["start"] = time.perf_counter()
+			self.running[job["id"]] = job
+			if self.pool is None:
+				self.pool = ProcessPoolExecutor(self.jobs, initializer=service_init, initargs=self.init)
+			job["pool"] = self.pool
+			self.pool.submit(service_run, (job["src"], job["dest"], self.kape)).add_done_callback(lambda fut, jid=job["id"]: self.done.put((jid, fut)))
+		return True
+	def b_complete(self, jid, fut):
+		job = self.running.pop(jid)
+		err = None
+		try:
+			elapsed, res = fut.result()
+		except BrokenProcessPool:
+			err = "a worker process terminated abruptly"
+			if job["pool"] is self.pool:
+				self.pool.shutdown(wait=False)
+				self.pool = None
+		except Exception as e:
+			err = str(e)
+		if err is not None:
+			self.bmcc.b_log(sys.stderr, False, 3, "Job %d failed while processing '%s': %s" % (jid, job["src"], err))
+			ok, cnt, last, fhash = False, 0, "", None
+			elapsed = time.perf_counter()-job["start"]
+		else:
+			src, ok, cnt, logs, dmap, last, fhash, stats = res
+			self.bmcc.b_replay(logs)
+			if stats is not None and self.f_stats is not None:
+				self.f_stats.append((src, ok, cnt, stats))
+			if self.d_map is not None:
+				self.d_map.writerows(dmap)
+		if self.state is not None:
+			self.state.b_done(job["src"], ok, cnt, last, fhash)
+		self.f_cnt+=1
+		self.f_ok+=1 if ok else 0
+		self.t_cnt+=cnt
+		size = job["size"] if ok else 0
+		for i, v in enumerate([1, cnt, size]):
+			self.window[i+1]+=v
+		queued = job["start"]-job["queued"]
+		self.bmcc.b_log(sys.stdout, False, 0 if ok else 3, "Job %d %s in %.2f s after %.2f s in queue: %d tiles from '%s' (%.0f tiles/s, %.1f MB/s)." % (jid, "completed" if ok else "failed", elapsed, queued, cnt, job["src"], cnt/max(elapsed, 1e-9), size/max(elapsed, 1e-9)/(1<<20)))
+		res = dict(ok=ok, exported=cnt, wall=round(elapsed, 6), queued=round(queued, 6), size=job["size"])
+		if err is not None:
+			res["error"] = err
+		return self.b_reply(job, res)
+	def b_poll(self):
+		seen = {}
+		for i, inbox in enumerate(self.inboxes):
+			for root, dirs, files in os.walk(inbox):
+				for f in files:
+					src = os.path.join(root, f)
+					if src in seen or not (self.carve or f.rsplit(".", 1)[-1].upper() in ["BIN", "BMC"]):
+						continue
+					try:
+						st = os.stat(src)
+					except OSError:
+						continue
+					sig = (st.st_size, st.st_mtime_ns)
+					old = self.seen.get(src)
+					seen[src] = (sig, old is not None and old[0] == sig and old[1])
+					if old is not None and old[0] == sig and not old[1]:
+						seen[src] = (sig, True)
+						self.b_submit(src, None, -i)
+		self.seen = seen
+		return True
+	def b_report(self, final=False):
+		now = time.perf_counter()
+		span = now-self.window[0]
+		if final or (span >= self.REPORT and self.window[1] > 0):
+			self.bmcc.b_log(sys.stdout, False, 1, "%d jobs completed in the last %.0f s (%.0f tiles/s, %.1f MB/s); %d running, %d pending." % (self.window[1], span, self.window[2]/max(span, 1e-9), self.window[3]/max(span, 1e-9)/(1<<20), len(self.running), len(self.heap)))
+			self.window = [now, 0, 0, 0]
+		return True
+	def b_halt(self, signum, frame):
+		self.stop.set()
+	def b_run(self):
+		handlers = [(s, signal.signal(s, self.b_halt)) for s in [signal.SIGINT, signal.SIGTERM]]
+		if self.listen is not None and self.UNIX:
+			if os.path.exists(self.listen) and stat.S_ISSOCK(os.stat(self.listen).st_mode):
+				os.unlink(self.listen)
+			umask = os.umask(0o177)
+			try:
+				self.server = socketserver.ThreadingUnixStreamServer(self.listen, BMCClient)
+			finally:
+				os.umask(umask)
+			self.bmcc.b_log(sys.stdout, False, 1, "Listening for jobs on '%s'." % (self.listen))
+		elif self.listen is not None:
+			self.server = socketserver.ThreadingTCPServer(("127.0.0.1", int(self.listen)), BMCClient)
+			self.bmcc.b_log(sys.stdout, False, 1, "Listening for jobs on 127.0.0.1:%d." % (self.server.server_address[1]))
+		if self.server is not None:
+			self.server.daemon_threads = True
+			self.server.service = self
+			threading.Thread(target=self.server.serve_forever, daemon=True).start()
+		for inbox in self.inboxes:
+			self.bmcc.b_log(sys.stdout, False, 1, "Watching inbox folder '%s'." % (inbox))
+		poll = 0
+		try:
+			while not self.stop.is_set():
+				if len(self.inboxes) > 0 and time.perf_counter() >= poll:
+					self.b_poll()
+					poll = time.perf_counter()+self.POLL
+				while not self.incoming.empty():
+					self.b_submit(*self.incoming.get())
+				self.b_dispatch()
+				try:
+					self.b_complete(*self.done.get(timeout=0.2))
+				except queue.Empty:
+					pass
+				self.b_report()
+			self.bmcc.b_log(sys.stdout, False, 1, "Stopping: %d pending jobs cancelled, waiting for %d running jobs." % (len(self.heap)+self.incoming.qsize(), len(self.running)))
+			if self.server is not None:
+				self.server.shutdown()
+				self.server.server_close()
+				if self.UNIX:
+					os.unlink(self.listen)
+			while not self.incoming.empty():
+				self.b_submit(*self.incoming.get())
+			for prio, seq, job in sorted(self.heap):
+				self.b_reject(job, "cancelled")
+			self.heap = []
+			while len(self.running) > 0:
+				self.b_complete(*self.done.get())
+			self.b_report(True)
+		finally:
+			if self.pool is not None:
+				self.pool.shutdown()
+			for s, h in handlers:
+				signal.signal(s, h)
+		return (self.f_cnt, self.f_ok, self.t_cnt)
+
+def iter_tiles(src, name=None, **kwargs):
+	if kwargs.get("tjobs", 1) > 1 and not isinstance(src, (str, os.PathLike)):
+		raise ValueError("tjobs > 1 requires a file name, as decoding processes open the source again")
+	bmcc = BMCContainer(**kwargs)
+	if bmcc.b_import(os.fspath(src)) if isinstance(src, (str, os.PathLike)) else bmcc.b_load(src, name):
+		try:
+			for t in bmcc.b_tiles():
+				yield t
+		finally:
+			bmcc.b_flush()
+
+def decode_tiles(src, name=None, **kwargs):
+	if kwargs.get("tjobs", 1) > 1 and not isinstance(src, (str, os.PathLike)):
+		raise ValueError("tjobs > 1 requires a file name, as decoding processes open the source again")
+	kwargs.setdefault("logs", [])
+	bmcc = BMCContainer(**kwargs)
+	if bmcc.b_import(os.fspath(src)) if isinstance(src, (str, os.PathLike)) else bmcc.b_load(src, name):
+		try:
+			for t in bmcc.b_tiles():
+				yield bmcc.b_image(t)
+		finally:
+			bmcc.b_flush()
+
+def kape_destination(dest, src):
+	destination = src.replace("\\","_").replace("//","_").replace(":","_").replace("_AppData_Local_Microsoft_Terminal Server Client_Cache","")
+	destination = dest + "\\" + destination
+	if not os.path.exists(destination):
+		os.makedirs(destination)
+	return destination
+
+def process_file(bmcc, src, dest, kape):
+	bmcc.ecnt = 0
+	bmcc.dmap = []
+	bmcc.last = ""
+	bmcc.fhash = None
+	if bmcc.stats is not None:
+		bmcc.stats = BMCStats()
+	bmcc.b_log(sys.stdout, False, 1, "Processing a file: '%s'." % (src))
+	try:
+		if not bmcc.b_import(src):
+			return False
+		if bmcc.index is not None and bmcc.select is None:
+			return bmcc.b_index()
+		destination = dest
+		if (kape == True):
+			destination = kape_destination(dest, src)
+		if bmcc.select is not None:
+			ok = bmcc.b_extract(destination) and bmcc.bres
+		else:
+			ok = bmcc.b_stream(destination) and bmcc.bres
+		if bmcc.hashing:
+			bmcc.fhash = hashlib.blake2b(bmcc.bdat).hexdigest()
+		return ok
+	except Exception as e:
+		bmcc.b_log(sys.stderr, False, 3, "Unexpected error while processing '%s': %s" % (src, e))
+		return False
+	finally:
+		bmcc.b_flush()
+
+def select_filter(expr):
+	flt = []
+	try:
+		for item in expr.split(","):
+			k, v = item.strip().split("=", 1)
+			if k == "n":
+				lo, sep, hi = v.partition("-")
+				flt.append(("index", int(lo or 0), int(hi) if hi else (2**64 if sep else int(lo))))
+			elif k == "key":
+				for f, x in zip(["key1", "key2"], v.split(":")):
+					if len(x) > 0:
+						flt.append((f, int(x, 0), int(x, 0)))
+			elif k == "size":
+				w, h = v.lower().split("x")
+				flt.append(("width", int(w), int(w)))
+				flt.append(("height", int(h), int(h)))
+			elif k == "bpp":
+				flt.append(("bpp", int(v), int(v)))
+			else:
+				raise ValueError(k)
+	except ValueError:
+		raise argparse.ArgumentTypeError("invalid tile filter '%s'" % (expr))
+	return flt
+
+def worker_init(kwargs, dedup, hashing):
+	global bmcw
+	bmcw = BMCContainer(logs=[], dedup=dedup, **kwargs)
+	bmcw.hashing = hashing
+
+def worker_run(job):
+	src, dest, kape = job
+	bmcw.logs = []
+	ok = process_file(bmcw, src, dest, kape)
+	return (src, ok, bmcw.ecnt, bmcw.logs, bmcw.dmap, bmcw.last, bmcw.fhash, bmcw.stats)
+
+def worker_pool(jobs, init, srcs, dest, kape):
+	pool = None
+	pending = deque(enumerate(srcs))
+	retry = deque()
+	running = {}
+	res = {}
+	suspect = set()
+	nxt = 0
+	try:
+		while nxt < len(srcs):
+			while len(retry) > 0 and len(running) == 0 or len(retry) == 0 and len(pending) > 0 and len(running) < jobs:
+				i, src = retry.popleft() if len(retry) > 0 else pending.popleft()
+				if pool is None:
+					pool = ProcessPoolExecutor(jobs, initializer=worker_init, initargs=init)
+				running[pool.submit(worker_run, (src, dest, kape))] = (i, src, pool)
+			for fut in wait(list(running), return_when=FIRST_COMPLETED)[0]:
+				i, src, fpool = running.pop(fut)
+				try:
+					res[i] = fut.result()
+				except BrokenProcessPool:
+					if fpool is pool:
+						pool.shutdown(wait=False)
+						pool = None
+					if i in suspect:
+						res[i] = (src, False, 0, [(True, "%s Worker process terminated abruptly while processing '%s'.%s" % (BMCContainer.LOG_TYPES[3], src, os.linesep))], [], "", None, None)
+					else:
+						suspect.add(i)
+						retry.append((i, src))
+			while nxt in res:
+				yield res.pop(nxt)
+				nxt+=1
+	finally:
+		if pool is not None:
+			pool.shutdown()
+
+def decode_init(verbose, stats):
+	global bmcd
+	bmcd = BMCContainer(verbose=verbose, logs=[], stats=stats)
+
+def decode_run(job):
+	fname, recs = job
+	if bmcd.fname != fname or len(bmcd.bdat) == 0:
+		bmcd.b_flush()
+		bmcd.b_import(fname)
+	if bmcd.stats is not None:
+		bmcd.stats = BMCStats()
+	res = []
+	for rec in recs:
+		bmcd.logs = []
+		t_bmp, o_bmp = bmcd.b_decode(rec)
+		res.append((t_bmp, o_bmp, bmcd.logs))
+	return (res, bmcd.stats)
+
+def service_signals():
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+def service_init(kwargs, dedup, hashing):
+	service_signals()
+	worker_init(kwargs, dedup, hashing)
+
+def service_run(job):
+	clk = time.perf_counter()
+	res = worker_run(job)
+	return (time.perf_counter()-clk, res)
+
 if __name__ == "__main__":
-	prs = argparse.ArgumentParser(description="RDP Bitmap Cache parser (v. 3.04, 2023/12/02)")
-	prs.add_argument("-s", "--src", help="Specify the BMCache file or directory to process.", required=True)
+	prs = argparse.ArgumentParser(description="RDP Bitmap Cache parser (v. %s, 2026/10/18)" % (BMCContainer.VERSION))
+	prs.add_argument("-s", "--src", help="Specify the BMCache file or directory to process (optional with -l/--inbox or -n/--listen).", default=None)
 	prs.add_argument("-d", "--dest", help="Specify the directory where to store the extracted bitmaps.", required=True)
 	prs.add_argument("-c", "--count", help="Only extract the given number of bitmaps.", type=int, default=-1)
 	prs.add_argument("-v", "--verbose", help="Determine the amount of information displayed.", action="store_true", default=False)
@@ -384,22 +1513,56 @@ if __name__ == "__main__":
 	prs.add_argument("-b", "--bitmap", help="Provide a big bitmap aggregating all the tiles.", action="store_true", default=False)
 	prs.add_argument("-w", "--width", help="Specify the number of tiles per line of the aggregated bitmap (default=64).", type=int, default=64)
 	prs.add_argument('-k', "--kape", help="Use this option to split out the different inputs into separate folders", action="store_true", default="False")
+	prs.add_argument("-j", "--jobs", help="Specify the number of files to process in parallel (default=1).", type=int, default=1)
+	prs.add_argument("-u", "--dedup", help="Only write each distinct bitmap once and record duplicates in a dedup.csv mapping file.", action="store_true", default=False)
+	prs.add_argument("-i", "--index", help="Only scan the tile headers and store them in a bmc-index.sqlite file inside the destination folder.", action="store_true", default=False)
+	prs.add_argument("-x", "--select", help="Only extract the tiles matching the given filter (n=FIRST-LAST, key=KEY1:KEY2, size=WxH, bpp=BPP, comma-separated); may be repeated.", type=select_filter, action="append", default=None)
+	prs.add_argument("-r", "--incremental", help="Skip the files already processed with the same options, as recorded in a bmc-state.sqlite file inside the destination folder.", action="store_true", default=False)
+	prs.add_argument("-f", "--force", help="Process every file again in incremental mode, even when unchanged.", action="store_true", default=False)
+	prs.add_argument("-t", "--tile-jobs", help="Specify the number of processes decoding the tiles of a single file (default=1); not available with -j/--jobs, -l/--inbox or -n/--listen.", type=int, default=1)
+	prs.add_argument("-p", "--stats", help="Write per-stage timings and statistics, per file and in aggregate, to the given JSON file.", default=None)
+	prs.add_argument("-e", "--format", help="Specify the format of the extracted bitmaps (default=bmp).", choices=["bmp", "png"], default="bmp")
+	prs.add_argument("-a", "--archive", help="Store the bitmaps extracted from each file, along with their tile metadata, in a single ZIP or tar archive.", choices=["zip", "tar"], default=None)
+	prs.add_argument("-q", "--writers", help="Specify the number of threads encoding and writing the extracted bitmaps while tiles are being decoded (default=0).", type=int, default=0)
+	prs.add_argument("-m", "--carve", help="Carve the tiles out of raw disk images or memory dumps; every file found under SRC is then processed.", action="store_true", default=False)
+	prs.add_argument("-g", "--stitch", help="Reconstruct screen fragments by matching the edges of the tiles, and store each of them in its own bitmap.", action="store_true", default=False)
+	prs.add_argument("-l", "--inbox", help="Keep running and process the files dropped into the given inbox directory; may be repeated, earlier inboxes having a higher priority.", action="append", default=None)
+	prs.add_argument("-n", "--listen", help="Keep running and process the jobs received on the given Unix socket, only accessible to the current user, or on the given 127.0.0.1 TCP port (0 picks a free one) where Unix sockets are not available.", default=None)
 	args = prs.parse_args(sys.argv[1:])
+	service = args.inbox is not None or args.listen is not None
+	if args.src is None and not service:
+		prs.error("the following arguments are required: -s/--src")
 
-	bmcc = BMCContainer(verbose=args.verbose, count=args.count, old=args.old, big=args.bitmap, width=args.width)
+	index = os.path.join(args.dest, "bmc-index.sqlite") if args.index or args.select is not None else None
+	bmcc = BMCContainer(verbose=args.verbose, count=args.count, old=args.old, big=args.bitmap, width=args.width, tjobs=args.tile_jobs, index=index, select=args.select, stats=args.stats is not None, fmt=args.format, bundle=args.archive, writers=args.writers, carve=args.carve, stitch=args.stitch)
+	clk = bmcc.stats.b_clock() if bmcc.stats is not None else None
 	src_files = []
 	if not os.path.isdir(args.dest):
 		sys.stderr.write("Destination folder '%s' does not exist.%s" % (args.dest, os.linesep))
 		exit(-1)
+	elif args.carve and index is not None:
+		sys.stderr.write("Carving cannot be combined with -i/--index or -x/--select.%s" % (os.linesep))
+		exit(-1)
+	elif args.tile_jobs > 1 and (args.jobs > 1 or service):
+		sys.stderr.write("-t/--tile-jobs cannot be combined with -j/--jobs, -l/--inbox or -n/--listen, whose worker processes cannot start their own pool.%s" % (os.linesep))
+		exit(-1)
+	elif service and not all([os.path.isdir(d) for d in args.inbox or []]):
+		sys.stderr.write("Inbox folder '%s' does not exist.%s" % ([d for d in args.inbox if not os.path.isdir(d)][0], os.linesep))
+		exit(-1)
+	elif args.listen is not None and args.listen.isdigit() == BMCService.UNIX:
+		sys.stderr.write("-n/--listen expects %s on this platform.%s" % ("a Unix socket path" if BMCService.UNIX else "a TCP port", os.linesep))
+		exit(-1)
+	elif args.src is None:
+		sys.stdout.write("[+++] Waiting for jobs...%s" % (os.linesep))
 	elif os.path.isdir(args.src):
 		sys.stdout.write("[+++] Processing a directory...%s" % (os.linesep))
 		for root, dirs, files in os.walk(args.src):
 			for f in files:
-				if f.rsplit(".", 1)[-1].upper() in ["BIN", "BMC"]:
+				if args.carve or f.rsplit(".", 1)[-1].upper() in ["BIN", "BMC"]:
 					if args.verbose:
 						sys.stdout.write("[---] File '%s' has been found.%s" % (os.path.join(root, f), os.linesep))
 					src_files.append(os.path.join(root, f))
-		if len(src_files) == 0:
+		if len(src_files) == 0 and not service:
 			sys.stderr.write("No suitable files were found under '%s' directory.%s" % (args.src, os.linesep))
 			exit(-1)
 	elif not os.path.isfile(args.src):
@@ -408,19 +1571,83 @@ if __name__ == "__main__":
 	else:
 		sys.stdout.write("[+++] Processing a single file: '%s'.%s" % (args.src, os.linesep))
 		src_files.append(args.src)
-	for src in src_files:
-		sys.stdout.write("[+++] Processing a file: '%s'.%s" % (src, os.linesep)) 		
-		if bmcc.b_import(src):
-			destination = args.dest
-			if (args.kape == True):
-				destination = src.replace("\\","_").replace("//","_").replace(":","_").replace("_AppData_Local_Microsoft_Terminal Server Client_Cache","")
-				destination = args.dest + "\\" + destination
-				if not os.path.exists(destination):
-					os.makedirs(destination)
-			
-			bmcc.b_process()
-			bmcc.b_export(destination)
-			bmcc.b_flush()
-		
-		
+	f_ok = 0
+	f_cnt = 0
+	t_cnt = 0
+	f_stats = []
+	state = None
+	if args.incremental:
+		state = BMCState(os.path.join(args.dest, "bmc-state.sqlite"), json.dumps(dict(count=args.count, old=args.old, bitmap=args.bitmap, width=args.width, kape=args.kape == True, dedup=args.dedup, index=args.index, select=args.select, format=args.format, archive=args.archive, carve=args.carve, stitch=args.stitch), sort_keys=True))
+		bmcc.hashing = True
+		if not args.force:
+			todo = [src for src in src_files if not state.b_unchanged(src)]
+			if len(todo) < len(src_files):
+				bmcc.b_log(sys.stdout, False, 2, "%d unchanged files already processed will be skipped." % (len(src_files)-len(todo)))
+			src_files = todo
+	d_map = None
+	if args.dedup:
+		d_path = os.path.join(args.dest, "dedup.csv")
+		d_new = state is None or not os.path.isfile(d_path)
+		d_file = open(d_path, "w" if d_new else "a", newline="")
+		d_map = csv.writer(d_file)
+		if d_new:
+			d_map.writerow(("source", "bitmap", "stored"))
+	w_args = dict(verbose=args.verbose, count=args.count, old=args.old, big=args.bitmap, width=args.width, index=index, select=args.select, stats=args.stats is not None, fmt=args.format, bundle=args.archive, writers=args.writers, carve=args.carve, stitch=args.stitch)
+	if service:
+		dedup = None
+		if args.dedup:
+			mgr = SyncManager()
+			mgr.start(service_signals)
+			dedup = mgr.dict()
+		svc = BMCService(bmcc, (w_args, dedup, state is not None), max(args.jobs, 1), args.dest, args.kape, args.carve, args.inbox, args.listen, state, args.force, d_map, f_stats)
+		for src in src_files:
+			svc.b_submit(src)
+		f_cnt, f_ok, t_cnt = svc.b_run()
+	elif args.jobs > 1 and len(src_files) > 1:
+		dedup = None
+		if args.dedup:
+			mgr = multiprocessing.Manager()
+			dedup = mgr.dict()
+		if state is not None:
+			for src in src_files:
+				state.b_start(src)
+		for src, ok, cnt, logs, dmap, last, fhash, stats in worker_pool(min(args.jobs, len(src_files)), (w_args, dedup, state is not None), src_files, args.dest, args.kape):
+			bmcc.b_replay(logs)
+			if stats is not None:
+				f_stats.append((src, ok, cnt, stats))
+			if d_map is not None:
+				d_map.writerows(dmap)
+			if state is not None:
+				state.b_done(src, ok, cnt, last, fhash)
+			f_cnt+=1
+			f_ok+=1 if ok else 0
+			t_cnt+=cnt
+	else:
+		if args.dedup:
+			bmcc.dedup = {}
+		for src in src_files:
+			if state is not None:
+				state.b_start(src)
+			ok = process_file(bmcc, src, args.dest, args.kape)
+			if bmcc.stats is not None:
+				f_stats.append((src, ok, bmcc.ecnt, bmcc.stats))
+			if d_map is not None:
+				d_map.writerows(bmcc.dmap)
+			if state is not None:
+				state.b_done(src, ok, bmcc.ecnt, bmcc.last, bmcc.fhash)
+			f_cnt+=1
+			f_ok+=1 if ok else 0
+			t_cnt+=bmcc.ecnt
+	if d_map is not None:
+		d_file.close()
+	if len(src_files) > 1 or service:
+		bmcc.b_log(sys.stdout, False, 0, "%d/%d files successfully processed, %d tiles extracted overall." % (f_ok, f_cnt, t_cnt))
+	if args.stats is not None:
+		total = BMCStats()
+		for src, ok, cnt, stats in f_stats:
+			total.b_merge(stats)
+		total = dict(files=f_cnt, ok=f_ok, exported=t_cnt, wall=time.perf_counter()-clk[0], cpu=time.process_time()-clk[1], **total.b_dict())
+		with open(args.stats, "w") as f:
+			json.dump(dict(version=BMCContainer.VERSION, files=[dict(source=src, ok=ok, exported=cnt, **stats.b_dict()) for src, ok, cnt, stats in f_stats], total=total), f, indent=1, sort_keys=True)
+		bmcc.b_log(sys.stdout, False, 0, "Statistics written to '%s'." % (args.stats))
 	del bmcc